@@ -0,0 +1,117 @@
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+
+from flaskr import create_app
+from flaskr.migrations import migrate
+from benchmarks.bench import seed, default_database_url
+from models import db, Question
+
+'''
+Memory and allocations of the question lists
+
+    Reads a page of questions the way the list endpoints did before
+    (Question instances) and do now (QuestionRow read models), formats
+    it, and reports for every way:
+    - the memory held by the page once read, with the identity map of
+      the session, and the live blocks allocated for it
+    - the peak memory while reading and formatting the page
+    - the time
+
+    Run from the backend folder:
+
+    python -m benchmarks.read_models --rows 100000 --page-size 10000
+'''
+
+
+def orm_page(limit):
+    return Question.query.order_by(Question.id).limit(limit).all()
+
+
+def read_model_page(limit):
+    return Question.rows().order_by(Question.id).limit(limit).all()
+
+
+WAYS = [
+    ('orm (before)', orm_page),
+    ('read models', read_model_page)
+]
+
+
+def measure(way, limit):
+    db.session.remove()
+    gc.collect()
+
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    started = time.perf_counter()
+
+    page = way(limit)
+    read_seconds = time.perf_counter() - started
+    retained = tracemalloc.get_traced_memory()[0]
+    live_blocks = sys.getallocatedblocks() - blocks
+
+    questions = [question.format() for question in page]
+    seconds = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    del page, questions
+    db.session.remove()
+
+    return {
+        'retained_kb': round(retained / 1024),
+        'live_blocks': live_blocks,
+        'peak_kb': round(peak / 1024),
+        'read_ms': round(read_seconds * 1000, 1),
+        'ms': round(seconds * 1000, 1)
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Measure the memory of the question lists.')
+    parser.add_argument(
+        '--rows', type=int, default=10000,
+        help='number of questions to seed')
+    parser.add_argument(
+        '--database-url',
+        help='SQLAlchemy database url, a SQLite file by default')
+    parser.add_argument(
+        '--page-size', type=int, action='append',
+        help='questions per page, 100 and 10000 by default')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    database_url = args.database_url or default_database_url(args.rows)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url})
+
+    with app.app_context():
+        migrate(db.engine)
+        seed(args.rows)
+
+        # the first query of a way compiles and caches its mappers
+        for label, way in WAYS:
+            measure(way, 1)
+
+        header = '{:<14} {:>9} {:>12} {:>12} {:>9} {:>9} {:>9}'
+        print(header.format(
+            'way', 'questions', 'retained KB', 'live blocks', 'peak KB',
+            'read ms', 'ms'))
+        for limit in args.page_size or [100, 10000]:
+            for label, way in WAYS:
+                result = measure(way, limit)
+                print(header.format(
+                    label, limit, result['retained_kb'],
+                    result['live_blocks'], result['peak_kb'],
+                    result['read_ms'], result['ms']))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
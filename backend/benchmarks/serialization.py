@@ -0,0 +1,114 @@
+import argparse
+import json
+import sys
+import time
+
+from flaskr import create_app
+from flaskr import serializer
+from flaskr.migrations import migrate
+from benchmarks.bench import seed, default_database_url
+from models import db, Question
+
+'''
+Serialization throughput of the question lists
+
+    Reads the questions and encodes them as JSON, the way the list
+    endpoints and the export did before (ORM objects, Question.format()
+    and the json module) and do now (rows and the serializer in use),
+    and reports the bytes per second of every way.
+
+    Run from the backend folder:
+
+    python -m benchmarks.serialization --rows 100000
+    python -m benchmarks.serialization --page-size 1000
+'''
+
+
+def orm_json(limit):
+    questions = Question.query.order_by(Question.id).limit(limit).all()
+    return json.dumps({
+        'questions': [question.format() for question in questions]
+    }).encode('utf-8')
+
+
+def rows_json(limit):
+    rows = Question.rows().order_by(Question.id).limit(limit).all()
+    return serializer.json_dumps({
+        'questions': [row.format() for row in rows]
+    })
+
+
+def rows_orjson(limit):
+    rows = Question.rows().order_by(Question.id).limit(limit).all()
+    return serializer.orjson_dumps({
+        'questions': [row.format() for row in rows]
+    })
+
+
+WAYS = [
+    ('orm + json (before)', orm_json),
+    ('rows + json', rows_json),
+    ('rows + orjson', rows_orjson)
+]
+
+
+def measure(way, limit, repeat):
+    size = 0
+    started = time.perf_counter()
+    for i in range(repeat):
+        size += len(way(limit))
+        db.session.remove()
+    seconds = time.perf_counter() - started
+
+    return {
+        'bytes': size // repeat,
+        'ms': round(seconds / repeat * 1000, 3),
+        'mb_per_second': round(size / seconds / 1e6, 2)
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Measure the JSON throughput of the question lists.')
+    parser.add_argument(
+        '--rows', type=int, default=10000,
+        help='number of questions to seed')
+    parser.add_argument(
+        '--database-url',
+        help='SQLAlchemy database url, a SQLite file by default')
+    parser.add_argument(
+        '--page-size', type=int, action='append',
+        help='questions per response, 10, 100 and all rows by default')
+    parser.add_argument('--repeat', type=int, default=5)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    database_url = args.database_url or default_database_url(args.rows)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url})
+
+    ways = WAYS
+    if serializer.default_serializer() != 'orjson':
+        print('orjson is not installed, skipping it')
+        ways = WAYS[:2]
+
+    with app.app_context():
+        migrate(db.engine)
+        rows = seed(args.rows)
+
+        header = '{:<22} {:>10} {:>12} {:>10} {:>8}'
+        print(header.format('way', 'questions', 'bytes', 'ms', 'MB/s'))
+        for limit in args.page_size or [10, 100, rows]:
+            repeat = args.repeat * max(1, 1000 // limit)
+            for label, way in ways:
+                result = measure(way, limit, repeat)
+                print(header.format(
+                    label, limit, result['bytes'], result['ms'],
+                    result['mb_per_second']))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
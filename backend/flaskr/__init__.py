@@ -1,13 +1,52 @@
-# import os
-from flask import Flask, request, redirect, url_for, abort, jsonify
+import io
+import os
+import time
+import click
+from flask import Flask, request, redirect, url_for, abort
+from flask import Response, stream_with_context, g
 # from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import Pagination
 from flask_cors import CORS
-# import random
-
-from models import setup_db, Question, Category
+import random
+
+from models import (
+    db, setup_db, database_path, engine_options, DEFAULT_REPLICA_LAG, Question,
+    Category)
+from .cache import category_cache
+from .pagination import (
+    is_cursor_request, paginate_by_cursor, category_key)
+from .quiz import quiz_engine
+from . import quiz_pack
+from . import stats
+from . import serializer
+from .search import (
+    search_backend, inverted_index_search, questions_by_ids)
+from .suggest import prefix_index, suggest_categories
+from .quiz_sessions import create_session_store, DEFAULT_TTL
+from . import bulk
+from . import export
+from .migrations import migrate
+from .conditional import (
+    data_version, current_etag, is_conditional_request, DEFAULT_INTERVAL)
+from .response_cache import (
+    response_cache, create_response_cache_backend, PageKey,
+    DEFAULT_MAX_BYTES, DEFAULT_TTL as DEFAULT_CACHE_TTL)
+from .metrics import (
+    jsonify, init_metrics, render_metrics, log_swallowed_exception)
+from .admission import (
+    init_admission, create_rate_limit_backend, rate_limits,
+    concurrency_limits)
 
 QUESTIONS_PER_PAGE = 10
 
+# questions of a quiz, by default and at most
+QUESTIONS_PER_QUIZ = 5
+MAX_QUESTIONS_PER_QUIZ = 100
+
+# suggestions of a search, by default and at most
+SUGGESTIONS_PER_QUERY = 10
+MAX_SUGGESTIONS = 50
+
 
 # formatting the question by function defined in the class
 def format_questions(all_questions):
@@ -19,11 +58,78 @@ def format_questions(all_questions):
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+
+    # the test config may point to another database
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+
+    # The database, its read replica and the engine options are taken
+    # from the config, else from DATABASE_URL, DATABASE_REPLICA_URL,
+    # DATABASE_REPLICA_LAG and the DB_* variables of the environment
+    database_url = app.config.get(
+        'SQLALCHEMY_DATABASE_URI',
+        os.environ.get('DATABASE_URL', database_path))
+    app.config.setdefault(
+        'SQLALCHEMY_ENGINE_OPTIONS', engine_options(database_url))
+    app.config.setdefault(
+        'DATABASE_REPLICA_URL', os.environ.get('DATABASE_REPLICA_URL'))
+    app.config.setdefault(
+        'DATABASE_REPLICA_LAG',
+        float(os.environ.get('DATABASE_REPLICA_LAG', DEFAULT_REPLICA_LAG)))
+
+    setup_db(app, database_url, app.config['DATABASE_REPLICA_URL'])
+
+    # the cached data may belong to a previously bound database
+    category_cache.invalidate()
+    quiz_engine.invalidate()
+    inverted_index_search.invalidate()
+    prefix_index.invalidate()
+    stats.counts.invalidate()
+    data_version.reset()
+
+    # JSON of the responses by orjson when installed,
+    # or by the serializer named by JSON_SERIALIZER (json or orjson)
+    serializer.use(os.environ.get('JSON_SERIALIZER'))
 
     # Initialize the CORS
     CORS(app)
 
+    # SQL statements, DB, serialization, view and total time of every
+    # request, sent in a Server-Timing header, logged and aggregated at
+    # /metrics. Registered first, so the total times the other hooks too.
+    init_metrics(app)
+
+    # Token buckets per client of the write and search endpoints, from
+    # RATE_LIMIT_WRITE and RATE_LIMIT_SEARCH, kept in memory or in Redis
+    # if RATE_LIMIT_STORE_URL is set, and a cap on the requests of each
+    # running at once, from CONCURRENCY_LIMIT_WRITE and
+    # CONCURRENCY_LIMIT_SEARCH. Answered with 429 and 503.
+    app.config.setdefault('RATE_LIMITS', rate_limits(os.environ))
+    app.config.setdefault(
+        'CONCURRENCY_LIMITS', concurrency_limits(app, os.environ))
+    admission = init_admission(
+        app, create_rate_limit_backend(os.environ.get('RATE_LIMIT_STORE_URL')))
+
+    # Quiz sessions are kept in memory,
+    # or in Redis if QUIZ_SESSION_STORE_URL is set
+    quiz_sessions = create_session_store(
+        os.environ.get('QUIZ_SESSION_STORE_URL'),
+        int(os.environ.get('QUIZ_SESSION_TTL', DEFAULT_TTL)))
+
+    # Pages of questions are cached in memory up to RESPONSE_CACHE_MAX_BYTES,
+    # or in Redis if RESPONSE_CACHE_URL is set, for RESPONSE_CACHE_TTL
+    # seconds at most
+    response_cache.backend = create_response_cache_backend(
+        os.environ.get('RESPONSE_CACHE_URL'),
+        int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+        float(os.environ.get('RESPONSE_CACHE_TTL', DEFAULT_CACHE_TTL)))
+    response_cache.clear()
+
+    # POST /quizzes draws the questions from the memory-mapped quiz pack
+    # of QUIZ_PACK_PATH if set, instead of the database
+    app.config.setdefault('QUIZ_PACK_PATH', os.environ.get('QUIZ_PACK_PATH'))
+    pack = quiz_pack.open_quiz_pack(app.config['QUIZ_PACK_PATH'])
+
     '''
     @TODO: Set up CORS. Allow '*' for origins.
     Delete the sample route after completing the TODOs
@@ -40,7 +146,43 @@ def create_app(test_config=None):
             'Content-Type,Authorization,true')
         response.headers.add(
             'Access-Control-Allow-Methods',
-            'GET, PUT, POST, DELETE, OPTIONS')
+            'GET, PUT, POST, PATCH, DELETE, OPTIONS')
+        return response
+
+    # The data version shared by the processes is read at most every
+    # DATA_VERSION_INTERVAL seconds, the caches are dropped when another
+    # process changed the questions or categories
+    app.config.setdefault(
+        'DATA_VERSION_INTERVAL',
+        float(os.environ.get('DATA_VERSION_INTERVAL', DEFAULT_INTERVAL)))
+    data_version.interval = app.config['DATA_VERSION_INTERVAL']
+
+    @app.before_request
+    def sync_data_version():
+        data_version.sync()
+
+    # Conditional GET: answer If-None-Match with 304 Not Modified
+    # while no question or category changed, without a database query
+    @app.before_request
+    def not_modified():
+        if not is_conditional_request():
+            return None
+
+        g.etag = current_etag()
+
+        if g.etag is not None and request.if_none_match.contains_weak(g.etag):
+            response = app.response_class(status=304)
+            response.set_etag(g.etag)
+            return response
+
+    # ETag of the read endpoints
+    @app.after_request
+    def set_etag(response):
+        etag = g.get('etag')
+        if etag is not None and response.status_code == 200:
+            response.set_etag(etag)
+            # caches have to revalidate before using the response
+            response.headers['Cache-Control'] = 'no-cache'
         return response
 
     '''
@@ -59,14 +201,46 @@ def create_app(test_config=None):
     '''
 
     def formatted_categories():
-        # get all categories
-        all_categories = Category.query.order_by(Category.id).all()
+        # get all categories from the in-process cache.
+        # the cache is invalidated whenever a category changes.
+        return category_cache.get()
+
+    # Get a page of questions after the cursor given in the request.
+    # total_questions is only counted if the client asks for it.
+    def questions_by_cursor(query, count, category_id=None):
+        questions, next_cursor, total_questions = paginate_by_cursor(
+            query, QUESTIONS_PER_PAGE, count, category_id)
+
+        current_category_type = None
+        if questions:
+            current_category_type = formatted_categories().get(
+                questions[0].category_id)
+
+        data = {
+            'success': True,
+            'questions': format_questions(questions),
+            'next_cursor': next_cursor,
+            'current_category': current_category_type
+        }
+
+        if total_questions is not None:
+            data['total_questions'] = total_questions
+
+        return data
 
-        categories = {}
-        for category in all_categories:
-            categories[category.id] = category.type
+    # Paginate like Query.paginate(), with the total number of questions
+    # taken from the cached counts instead of a COUNT(*) query
+    def paginate(query, page, total_questions):
+        if page < 1:
+            abort(404)
+
+        items = query.limit(QUESTIONS_PER_PAGE).offset(
+            (page - 1) * QUESTIONS_PER_PAGE).all()
+        if not items and page != 1:
+            abort(404)
 
-        return categories
+        return Pagination(
+            query, page, QUESTIONS_PER_PAGE, total_questions, items)
 
     '''
     @TODO:
@@ -83,7 +257,7 @@ def create_app(test_config=None):
 
         data = {
             'success': True,
-            'categories': formatted_categories(),
+            'categories': categories,
             'total_categories': total_categories
         }
 
@@ -104,17 +278,32 @@ def create_app(test_config=None):
     '''
 
     # Get all the questions. Default page = 1
+    # With ?after=<cursor>&limit=N the questions are paginated by cursor
     @app.route('/questions')
     def get_questions():
+        if is_cursor_request():
+            data = questions_by_cursor(
+                Question.rows(), stats.total_questions)
+            data['categories'] = formatted_categories()
+
+            return jsonify(data)
+
         try:
             # Get the parameter page from the request and by default page=1
             page = request.args.get('page', 1, type=int)
 
+            # serve the page from the response cache
+            cache_key = PageKey('questions', None, page, None)
+            data = response_cache.get(cache_key, stats.total_questions)
+            if data is not None:
+                return jsonify(data)
+            generation = response_cache.generation
+
             # Get the questions in the form of Pagination object
             # according to the page number
-            questions_in_range_obj = Question.query.order_by(
-                Question.category_id).paginate(
-                    per_page=QUESTIONS_PER_PAGE, page=page, error_out=True)
+            questions_in_range_obj = paginate(
+                Question.rows().order_by(category_key, Question.id),
+                page, stats.total_questions())
 
             # Get the total number of questions from the Pagination object
             total_questions = questions_in_range_obj.total
@@ -131,15 +320,13 @@ def create_app(test_config=None):
             if len(questions_in_range) == 0:
                 abort(404)
 
-            # get the category of the 1st question
-            current_category = questions_in_range[0].category
-
-            # get the category type of the 1st question. Ex.: 'Science'
-            current_category_type = current_category.type
-
             # Get the categories as a dictionay of {id: type, id: type}
             categories = formatted_categories()
 
+            # get the category type of the 1st question. Ex.: 'Science'
+            current_category_type = categories.get(
+                questions_in_range[0].category_id)
+
             data = {
                 'success': True,
                 'questions': formatted_questions,
@@ -148,6 +335,10 @@ def create_app(test_config=None):
                 'current_category': current_category_type
             }
 
+            response_cache.put(
+                cache_key, data, questions_in_range, QUESTIONS_PER_PAGE,
+                generation)
+
             # send data in json format
             return jsonify(data)
 
@@ -186,6 +377,60 @@ def create_app(test_config=None):
         except Exception:
             abort(422)
 
+    '''
+    DELETE '/questions'
+    - Deletes the questions selected by ids, by a filter or both,
+        in one statement and one transaction.
+    - Request Body: {'ids': [2, 4], 'filter': {'category': 2,
+        'difficulty': 1, 'search_term': 'title'}}, ids or filter
+    - Returns: the number of deleted questions
+    '''
+
+    # Delete many questions at once
+    @app.route('/questions', methods=['DELETE'])
+    def delete_questions():
+        try:
+            deleted = bulk.delete_questions(request.get_json())
+        except (AttributeError, TypeError, ValueError):
+            abort(400)
+        except Exception:
+            abort(422)
+
+        data = {
+            'success': True,
+            'deleted': deleted
+        }
+
+        return jsonify(data)
+
+    '''
+    PATCH '/questions'
+    - Sets fields of the questions selected by ids, by a filter or both,
+        in one statement and one transaction.
+    - Request Body: {'ids': [2, 4], 'filter': {...},
+        'set': {'category': 3, 'difficulty': 2, 'answer': '...'}},
+        ids or filter as for DELETE '/questions'. The category is its
+        id or its type.
+    - Returns: the number of updated questions
+    '''
+
+    # Update many questions at once
+    @app.route('/questions', methods=['PATCH'])
+    def update_questions():
+        try:
+            updated = bulk.update_questions(request.get_json())
+        except (AttributeError, TypeError, ValueError):
+            abort(400)
+        except Exception:
+            abort(422)
+
+        data = {
+            'success': True,
+            'updated': updated
+        }
+
+        return jsonify(data)
+
     '''
     @TODO:
     Create an endpoint to POST a new question,
@@ -248,6 +493,110 @@ def create_app(test_config=None):
         except Exception:
             abort(400)
 
+    '''
+    POST '/questions/bulk'
+    - Imports many questions at once, inserted in batches.
+        Existing questions are skipped.
+    - Request Body: JSON Lines (default) or CSV (Content-Type: text/csv),
+        one question per line with question, answer, difficulty, category.
+        The category is its id or its type.
+    - Request Arguments: batch_size (int) [optional]
+    - Returns: the number of rows, inserted, skipped and invalid questions
+        and the throughput of every batch
+    '''
+
+    # Import questions in bulk
+    @app.route('/questions/bulk', methods=['POST'])
+    def import_questions():
+        batch_size = request.args.get(
+            'batch_size', bulk.DEFAULT_BATCH_SIZE, type=int)
+        if batch_size < 1 or batch_size > bulk.MAX_BATCH_SIZE:
+            abort(400)
+
+        file_format = request.args.get(
+            'format', bulk.guess_format(request.content_type))
+        if file_format not in bulk.FORMATS:
+            abort(400)
+
+        # read the body line by line instead of loading it at once
+        lines = io.TextIOWrapper(request.stream, encoding='utf-8')
+        rows = bulk.read_rows(lines, file_format)
+
+        try:
+            summary = bulk.import_questions(rows, batch_size)
+        except Exception:
+            abort(422)
+
+        data = {'success': True}
+        data.update(summary)
+
+        return jsonify(data)
+
+    '''
+    GET '/questions/export'
+    - Streams all questions, ordered by id, one question per line.
+    - Request Arguments: format (ndjson or csv) [optional],
+        category (int) [optional] to export only one category
+    - Returns: the questions as formatted by Question.format()
+    '''
+
+    # Export the question bank
+    @app.route('/questions/export')
+    def export_questions():
+        file_format = request.args.get('format', 'ndjson')
+        if file_format not in export.FORMATS:
+            abort(400)
+
+        category_id = request.args.get('category', type=int)
+        if 'category' in request.args and category_id is None:
+            abort(400)
+        if category_id is not None and \
+                category_id not in formatted_categories():
+            abort(404)
+
+        lines = export.export_lines(file_format, category_id)
+        response = Response(
+            stream_with_context(lines),
+            mimetype=export.FORMATS[file_format])
+        response.headers['Content-Disposition'] = \
+            'attachment; filename=questions.{}'.format(file_format)
+
+        return response
+
+    '''
+    GET '/questions/suggest?q=<text>&limit=<n>'
+    - Suggests questions and categories while the search term is typed,
+        from an in-process prefix index, without a database query.
+        Every word of the text has to start a word of the suggestion.
+    - Request Arguments: q, and limit (default 10, at most 50)
+    - Returns: {'success': True, 'questions': [{'id': 5, 'question':
+        '...', 'category': 4}], 'categories': [{'id': 4,
+        'type': 'History'}]}
+    '''
+
+    # Suggest questions and categories for a search term being typed
+    @app.route('/questions/suggest')
+    def suggest_questions():
+        text = request.args.get('q', '')
+        limit = request.args.get('limit', SUGGESTIONS_PER_QUERY, type=int)
+        if limit < 1 or limit > MAX_SUGGESTIONS:
+            abort(400)
+
+        data = {
+            'success': True,
+            'questions': [
+                {'id': question_id, 'question': question,
+                 'category': category_id}
+                for question_id, question, category_id in
+                prefix_index.suggest(text, limit)],
+            'categories': [
+                {'id': category_id, 'type': category_type}
+                for category_id, category_type in suggest_categories(
+                    formatted_categories(), text, limit)]
+        }
+
+        return jsonify(data)
+
     '''
     @TODO:
     Create a POST endpoint to get questions based on a search term.
@@ -281,30 +630,35 @@ def create_app(test_config=None):
             # to return all questions. Else it will crash.
             search_item = body.get('searchTerm', '')
 
-            # Get the questions in the form of Pagination object
-            # according to the page number
-            # order by the category_id
-            questions_in_range_obj = Question.query.order_by(
-                Question.category_id).filter(Question.question.ilike(
-                    '%{}%'.format(search_item))).paginate(
-                        per_page=QUESTIONS_PER_PAGE, page=page, error_out=True)
+            # paginate out of range like Pagination does
+            if page < 1:
+                abort(404)
 
-            # Get the total number of questions from the Pagination object
-            total_questions = questions_in_range_obj.total
+            # serve the page from the response cache
+            cache_key = PageKey('search', None, page, search_item.lower())
+            data = response_cache.get(
+                cache_key,
+                lambda: search_backend().search(search_item, 1, 1)[1])
+            if data is not None:
+                return jsonify(data)
+            generation = response_cache.generation
 
-            # Get the items from the Pagination object
-            questions_in_range = questions_in_range_obj.items
+            # Get the questions of the page ranked by the search backend,
+            # a trigram index on PostgreSQL, an in-process index otherwise
+            questions_in_range, total_questions = search_backend().search(
+                search_item, page, QUESTIONS_PER_PAGE)
+
+            if page > 1 and len(questions_in_range) == 0:
+                abort(404)
 
             # format the questions
             formatted_questions = format_questions(questions_in_range)
 
             # if there is questions in range, return this
             if len(questions_in_range) > 0:
-                # get the category of the 1st question
-                current_category = questions_in_range[0].category
-
                 # get the category type of the 1st question. Ex.: 'Science'
-                current_category_type = current_category.type
+                current_category_type = formatted_categories().get(
+                    questions_in_range[0].category_id)
 
                 data = {
                     'success': True,
@@ -322,6 +676,10 @@ def create_app(test_config=None):
                     'current_category': None
                 }
 
+            response_cache.put(
+                cache_key, data, questions_in_range, QUESTIONS_PER_PAGE,
+                generation)
+
             # send data in json format
             return jsonify(data)
 
@@ -338,18 +696,41 @@ def create_app(test_config=None):
     '''
 
     # Get questions from a category
+    # With ?after=<cursor>&limit=N the questions are paginated by cursor
     @app.route('/categories/<int:category_id>/questions')
     def get_questions_from_category(category_id):
+        if is_cursor_request():
+            current_category_type = formatted_categories().get(category_id)
+
+            if current_category_type is None:
+                abort(404)
+
+            data = questions_by_cursor(
+                Question.rows(), lambda: stats.total_questions(category_id),
+                category_id)
+            data['current_category'] = current_category_type
+
+            return jsonify(data)
+
         try:
             # Get the parameter page from the request and by default page=1
             page = request.args.get('page', 1, type=int)
 
+            # serve the page from the response cache
+            cache_key = PageKey('category', category_id, page, None)
+            data = response_cache.get(
+                cache_key, lambda: stats.total_questions(category_id))
+            if data is not None:
+                return jsonify(data)
+            generation = response_cache.generation
+
             # Get the questions in the form of Pagination object
             # according to the page number
-            questions_in_range_obj = Question.query.order_by(
-                Question.category_id).filter(
-                Question.category_id == category_id).paginate(
-                    per_page=QUESTIONS_PER_PAGE, page=page, error_out=True)
+            questions_in_range_obj = paginate(
+                Question.rows().order_by(
+                    Question.category_id, Question.id).filter(
+                    Question.category_id == category_id),
+                page, stats.total_questions(category_id))
 
             # Get the total number of questions from the Pagination object
             total_questions = questions_in_range_obj.total
@@ -365,11 +746,11 @@ def create_app(test_config=None):
             if len(questions_in_range) == 0:
                 abort(404)
 
-            # get the category from category_id
-            current_category = Category.query.get(category_id)
+            # get the category type from category_id. Ex.: 'Science'
+            current_category_type = formatted_categories().get(category_id)
 
-            # get the category type of the 1st question. Ex.: 'Science'
-            current_category_type = current_category.type
+            if current_category_type is None:
+                abort(404)
 
             data = {
                 'success': True,
@@ -378,6 +759,10 @@ def create_app(test_config=None):
                 'current_category': current_category_type
             }
 
+            response_cache.put(
+                cache_key, data, questions_in_range, QUESTIONS_PER_PAGE,
+                generation)
+
             # send data in json format
             return jsonify(data)
 
@@ -408,6 +793,10 @@ def create_app(test_config=None):
 
             body = request.get_json()
 
+            # with a quiz session, the next question comes from its deck
+            if 'session_id' in body:
+                return jsonify(next_session_question(body['session_id']))
+
             # get the list of previous questions
             previous_questions_ids = body.get('previous_questions', [])
 
@@ -419,43 +808,29 @@ def create_app(test_config=None):
             # make sure to convert the category id to int
             category_id = int(quiz_category['id'])
 
-            # use print to debug
-            # print(body)
-            # print(previous_questions)
-            # print(category_id)
-
-            # at first get all questions of that category
-            # order by the Question.id
-            all_questions = Question.query.order_by(Question.id).filter(
-                Question.category_id == category_id).all()
-
-            # some categories may have less than 5 questions.
-            # Suppose a category has 2 questions.
-            # So, after 2 questions, the game will crash
-            # If the length of the previous_questions_ids is equal or greater
-            # than the all_questions of this category,
-            # that means, all questions from this category is over.
-            # Now generate a random question from all_questions
-            # which is not previously generated to avoid the crash
-
-            if len(previous_questions_ids) >= len(all_questions):
-                all_questions = Question.query.order_by(Question.id).all()
-
-            random_question = {}
-            # run this while loop while random_question is not empty
-            # loop through all_questions and match the id
-            # with the previous_questions_ids.
-            # if an id is not present in previous_questions_ids,
-            # add the corresponding question after formatting
-            # as the random_question
-            while bool(random_question) is False:
-                for question in all_questions:
-                    if question.id not in previous_questions_ids:
-                        random_question = question.format()
+            # the questions of the quiz pack or of the quiz engine
+            source = pack or quiz_engine
+
+            # an unknown category is not found
+            if category_id != 0 and not (
+                    pack.has_category(category_id) if pack else
+                    category_id in formatted_categories()):
+                abort(404)
+
+            # pick a random question of the category from the source,
+            # which is not one of the previous questions.
+            # None means all questions of the category were asked.
+            question_id = source.pick(
+                category_id, set(map(int, previous_questions_ids)))
+
+            random_question = None
+            if question_id is not None:
+                random_question = question_by_id(question_id)
 
             data = {
                 'success': True,
                 'question': random_question,
+                'finished': random_question is None,
                 'current_category': quiz_category['type']
             }
 
@@ -465,6 +840,326 @@ def create_app(test_config=None):
         except Exception:
             abort(404)
 
+    # Pop the next question of the deck of a quiz session
+    def next_session_question(session_id):
+        try:
+            question_id, current_category = quiz_sessions.pop(session_id)
+        except KeyError:
+            # unknown or expired session
+            abort(404)
+
+        random_question = None
+        while question_id is not None:
+            random_question = question_by_id(question_id)
+
+            if random_question is not None:
+                break
+
+            # the question was deleted after the session was created
+            question_id, current_category = quiz_sessions.pop(session_id)
+
+        data = {
+            'success': True,
+            'question': random_question,
+            'finished': random_question is None,
+            'current_category': current_category
+        }
+
+        return data
+
+    # the formatted question of the id from the quiz pack or the
+    # database, None if unknown
+    def question_by_id(question_id):
+        if pack is not None:
+            return pack.question(question_id)
+
+        question = Question.rows().filter(
+            Question.id == question_id).one_or_none()
+        return question.format() if question is not None else None
+
+    # {int: weight} of the weights given as {"1": 2, "3": 1}
+    def parse_weights(weights):
+        if weights is None:
+            return None
+        weights = {int(key): float(weight) for key, weight in weights.items()}
+        if any(weight < 0 for weight in weights.values()):
+            abort(400)
+        return weights
+
+    '''
+    POST '/quizzes/generate'
+    - Generates a whole quiz of distinct random questions at once,
+        mixing categories and difficulties by weight.
+    - Request Body: {'questions': 10, 'categories': {'1': 2, '4': 1},
+        'difficulties': {'1': 1, '2': 1, '3': 1}, 'ramp': true,
+        'previous_questions': [12, 14]}, every field is optional
+    - Returns: the questions, ordered by difficulty if ramp is true
+    '''
+
+    # Generate a quiz
+    @app.route('/quizzes/generate', methods=['POST'])
+    def generate_quiz():
+        try:
+            body = request.get_json()
+
+            count = int(body.get('questions', QUESTIONS_PER_QUIZ))
+            if count < 1 or count > MAX_QUESTIONS_PER_QUIZ:
+                abort(400)
+
+            category_weights = parse_weights(body.get('categories'))
+            if category_weights is not None and \
+                    not set(category_weights) <= set(formatted_categories()):
+                abort(400)
+
+            question_ids = quiz_engine.generate(
+                count,
+                category_weights,
+                parse_weights(body.get('difficulties')),
+                set(map(int, body.get('previous_questions', []))))
+
+            questions = questions_by_ids(question_ids)
+
+            # ramp the difficulty up along the quiz
+            if body.get('ramp'):
+                questions.sort(key=lambda question: question.difficulty)
+
+            data = {
+                'success': True,
+                'questions': format_questions(questions),
+                'total_questions': len(questions)
+            }
+
+            return jsonify(data)
+
+        except Exception:
+            abort(400)
+
+    '''
+    POST '/quizzes/batch'
+    - Returns a whole round of distinct random questions of the category
+        at once, to be prefetched instead of calling POST '/quizzes'
+        for every question.
+    - Request Body: {'previous_questions': [12, 14], 'quiz_category':
+        {'type': 'Art', 'id': '2'}, 'count': 5, 'separate_answers': true},
+        count and separate_answers are optional
+    - Returns: the questions, and the answers as {id: answer} apart
+        from them if separate_answers is true
+    '''
+
+    # Get a round of questions to play
+    @app.route('/quizzes/batch', methods=['POST'])
+    def get_quiz_batch():
+        body = request.get_json() or {}
+
+        # a bad count is a bad request, checked before the try
+        # which answers the other errors with 404
+        try:
+            count = int(body.get('count', QUESTIONS_PER_QUIZ))
+        except (TypeError, ValueError):
+            abort(400)
+        if count < 1 or count > MAX_QUESTIONS_PER_QUIZ:
+            abort(400)
+
+        try:
+            quiz_category = body.get('quiz_category')
+            category_id = int(quiz_category['id'])
+
+            # an unknown category is not found
+            if category_id != 0 and category_id not in formatted_categories():
+                abort(404)
+
+            # all questions of the category are equally likely,
+            # category id 0 stands for all categories
+            category_weights = None if category_id == 0 else {category_id: 1}
+            question_ids = quiz_engine.generate(
+                count, category_weights, None,
+                set(map(int, body.get('previous_questions', []))))
+
+            questions = format_questions(questions_by_ids(question_ids))
+
+            data = {
+                'success': True,
+                'questions': questions,
+                'total_questions': len(questions),
+                # the category ran out of questions
+                'finished': len(questions) < count,
+                'current_category': quiz_category['type']
+            }
+
+            # keep the answers apart, to be shown after answering
+            if body.get('separate_answers'):
+                data['answers'] = {
+                    question['id']: question.pop('answer')
+                    for question in questions}
+
+            return jsonify(data)
+
+        except Exception:
+            abort(404)
+
+    '''
+    POST '/quizzes/sessions'
+    - Creates a quiz session holding a shuffled deck of the question ids
+        of the category. The following POST '/quizzes' requests only send
+        the session_id instead of the list of previous questions.
+    - Request Body: {'quiz_category': {'type': 'Art', 'id': '2'},
+        'questions_per_play': 5}, questions_per_play is optional
+    - Returns: session_id and total_questions in the deck
+    '''
+
+    # Create a quiz session
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+        body = request.get_json() or {}
+
+        try:
+            quiz_category = body['quiz_category']
+            category_id = int(quiz_category['id'])
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+
+        # an unknown category is not found, as for POST '/quizzes'
+        if category_id != 0 and category_id not in formatted_categories():
+            abort(404)
+
+        try:
+            deck = quiz_engine.deck(category_id)
+
+            # shuffle the whole deck, or only draw the questions to play
+            questions_per_play = body.get('questions_per_play')
+            if questions_per_play is None:
+                questions_per_play = len(deck)
+            questions_per_play = min(int(questions_per_play), len(deck))
+
+            question_ids = random.sample(deck, questions_per_play)
+
+            session_id = quiz_sessions.create(
+                question_ids, quiz_category['type'])
+
+            data = {
+                'success': True,
+                'session_id': session_id,
+                'total_questions': len(question_ids),
+                'current_category': quiz_category['type']
+            }
+
+            return jsonify(data)
+
+        except Exception:
+            abort(400)
+
+    '''
+    GET '/stats'
+    - Returns the number of questions of the question bank, of every
+        category and of every difficulty, from the cached counts
+    '''
+
+    # Aggregates of the question bank
+    @app.route('/stats')
+    def get_stats():
+        data = {'success': True}
+        data.update(stats.question_stats(formatted_categories()))
+
+        return jsonify(data)
+
+    # Hit and miss counters of the in-process caches
+    @app.route('/cache/stats')
+    def get_cache_stats():
+        data = {
+            'success': True,
+            'category_cache': category_cache.stats(),
+            'response_cache': response_cache.stats()
+        }
+
+        return jsonify(data)
+
+    # Request histograms and cache counters in the Prometheus text format
+    @app.route('/metrics')
+    def get_metrics():
+        gauges = {}
+        for name, cache in [('category_cache', category_cache),
+                            ('response_cache', response_cache)]:
+            for key, value in cache.stats().items():
+                gauges['trivia_{}_{}'.format(name, key)] = value
+        for endpoint_class, running in admission.running().items():
+            gauges['trivia_running_{}_requests'.format(
+                endpoint_class)] = running
+
+        return Response(
+            render_metrics(gauges),
+            mimetype='text/plain; version=0.0.4')
+
+    '''
+    flask init-db
+    - Creates or upgrades the database schema by applying the pending
+        migrations, reporting the time of every migration.
+    '''
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        def report(step):
+            click.echo(
+                'migration {version}: {description} '
+                'in {seconds}s'.format(**step))
+
+        started = time.perf_counter()
+        steps = migrate(db.engine, report)
+
+        if not steps:
+            click.echo('the database schema is up to date')
+        click.echo('{} migrations in {:.3f}s'.format(
+            len(steps), time.perf_counter() - started))
+
+    '''
+    flask build-quiz-pack [PATH]
+    - Writes a quiz pack, the snapshot of the questions and categories
+        served by POST '/quizzes' when QUIZ_PACK_PATH points to it.
+        PATH defaults to QUIZ_PACK_PATH, else quiz.pack.
+    '''
+
+    @app.cli.command('build-quiz-pack')
+    @click.argument('path', required=False)
+    def build_quiz_pack_command(path):
+        path = path or app.config['QUIZ_PACK_PATH'] or quiz_pack.DEFAULT_PATH
+        summary = quiz_pack.build_quiz_pack(path)
+
+        click.echo(
+            '{questions} questions and {categories} categories written to '
+            '{path} ({bytes} bytes) in {seconds}s'.format(
+                path=path, **summary))
+
+    '''
+    flask import-questions PATH
+    - Imports the questions of a JSON Lines or CSV file, - for stdin.
+        Same as POST '/questions/bulk', reporting every batch.
+    '''
+
+    @app.cli.command('import-questions')
+    @click.argument('path', type=click.File('r', encoding='utf-8'))
+    @click.option(
+        '--format', 'file_format', type=click.Choice(bulk.FORMATS),
+        help='Format of the file, guessed from its name by default.')
+    @click.option(
+        '--batch-size', default=bulk.DEFAULT_BATCH_SIZE, show_default=True,
+        type=click.IntRange(1, bulk.MAX_BATCH_SIZE))
+    def import_questions_command(path, file_format, batch_size):
+        file_format = file_format or bulk.guess_format(path.name)
+
+        def report(batch):
+            click.echo(
+                'batch {batch}: {inserted} inserted, {skipped} skipped '
+                'in {seconds}s ({rows_per_second} rows/s)'.format(**batch))
+
+        summary = bulk.import_questions(
+            bulk.read_rows(path, file_format), batch_size, report)
+
+        click.echo(
+            '{rows} rows: {inserted} inserted, {skipped} skipped, '
+            '{invalid} invalid in {seconds}s '
+            '({rows_per_second} rows/s)'.format(**summary))
+        for error in summary['errors']:
+            click.echo('row {row}: {error}'.format(**error), err=True)
+
     @app.route('/')
     def index():
         return redirect(url_for('get_questions'))
@@ -477,6 +1172,8 @@ def create_app(test_config=None):
 
     @app.errorhandler(400)
     def bad_request(error):
+        log_swallowed_exception(error)
+
         data = {
             'success': False,
             'error': 400,
@@ -486,6 +1183,8 @@ def create_app(test_config=None):
 
     @app.errorhandler(404)
     def not_found(error):
+        log_swallowed_exception(error)
+
         data = {
             'success': False,
             'error': 404,
@@ -495,6 +1194,8 @@ def create_app(test_config=None):
 
     @app.errorhandler(405)
     def method_not_allowed(error):
+        log_swallowed_exception(error)
+
         data = {
             'success': False,
             'error': 405,
@@ -504,6 +1205,8 @@ def create_app(test_config=None):
 
     @app.errorhandler(422)
     def unprocessable(error):
+        log_swallowed_exception(error)
+
         data = {
             'success': False,
             'error': 422,
@@ -511,8 +1214,28 @@ def create_app(test_config=None):
         }
         return jsonify(data), 422
 
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        data = {
+            'success': False,
+            'error': 429,
+            'message': 'too many requests'
+        }
+        return jsonify(data), 429, {'Retry-After': g.get('retry_after', 1)}
+
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        data = {
+            'success': False,
+            'error': 503,
+            'message': 'service unavailable'
+        }
+        return jsonify(data), 503, {'Retry-After': g.get('retry_after', 1)}
+
     @app.errorhandler(500)
     def internal_server_error(error):
+        log_swallowed_exception(error)
+
         data = {
             'success': False,
             'error': 500,
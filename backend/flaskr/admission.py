@@ -0,0 +1,287 @@
+import math
+import threading
+import time
+
+from flask import g, request, abort
+
+from .metrics import rejected_requests
+
+'''
+Admission control of the write and search endpoints
+
+    Every request of a limited endpoint passes two checks, before its
+    handler runs:
+    - a token bucket per client and endpoint class, refilled at a steady
+      rate up to a burst. An empty bucket answers 429 Too Many Requests
+      with a Retry-After header.
+    - a cap on the requests of the endpoint class running at once in the
+      process, kept below the connections of the database pool, so a
+      burst of searches cannot hold every connection. A request above the
+      cap is shed at once with 503 Service Unavailable.
+
+    The buckets are kept in a backend:
+    - MemoryRateLimitBackend, in the process (default)
+    - RedisRateLimitBackend, shared by all processes
+    The rejected requests are counted at /metrics.
+'''
+
+# the endpoint class of every limited endpoint
+ENDPOINT_CLASSES = {
+    'create_question': 'write',
+    'delete_question': 'write',
+    'delete_questions': 'write',
+    'update_questions': 'write',
+    'import_questions': 'write',
+    'search_questions': 'search'
+}
+
+# {endpoint class: (requests per second, burst)}
+DEFAULT_RATE_LIMITS = {
+    'write': (5.0, 20),
+    'search': (10.0, 30)
+}
+
+RETRY_AFTER_UNAVAILABLE = 1
+
+
+'''
+parse_rate_limit(value)
+    (rate, burst) of 'rate/burst' or 'rate', None for '0'
+'''
+
+
+def parse_rate_limit(value):
+    rate, _, burst = value.partition('/')
+    rate = float(rate)
+    if rate <= 0:
+        return None
+    return rate, int(burst) if burst else max(1, int(rate))
+
+
+'''
+rate_limits(environ)
+    {endpoint class: (rate, burst)} of the defaults, overridden by
+    RATE_LIMIT_WRITE and RATE_LIMIT_SEARCH. A class set to 0 is not
+    rate limited.
+'''
+
+
+def rate_limits(environ):
+    limits = {}
+    for endpoint_class, default in DEFAULT_RATE_LIMITS.items():
+        value = environ.get('RATE_LIMIT_' + endpoint_class.upper())
+        limit = parse_rate_limit(value) if value else default
+        if limit is not None:
+            limits[endpoint_class] = limit
+    return limits
+
+
+# the connections of the pool, the default pool has 5 + 10 overflow
+def pool_connections(app):
+    options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+    return options.get('pool_size', 5) + options.get('max_overflow', 10)
+
+
+'''
+concurrency_limits(app, environ)
+    {endpoint class: requests at once} of CONCURRENCY_LIMIT_WRITE and
+    CONCURRENCY_LIMIT_SEARCH, half of the pool connections by default,
+    so the reads keep the other half. A class set to 0 is not capped.
+'''
+
+
+def concurrency_limits(app, environ):
+    default = max(1, pool_connections(app) // 2)
+    limits = {}
+    for endpoint_class in DEFAULT_RATE_LIMITS:
+        limit = int(environ.get(
+            'CONCURRENCY_LIMIT_' + endpoint_class.upper(), default))
+        if limit > 0:
+            limits[endpoint_class] = limit
+    return limits
+
+
+'''
+MemoryRateLimitBackend
+    the buckets as {key: [tokens, updated_at, seconds to refill]}.
+    A bucket idle long enough to be full again is dropped.
+'''
+
+
+class MemoryRateLimitBackend:
+
+    # seconds between two sweeps of the idle buckets
+    SWEEP_INTERVAL = 60
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._buckets = {}
+        self._next_sweep = 0
+        self._lock = threading.Lock()
+
+    '''
+    take(key, rate, burst)
+        takes a token of the bucket. Returns 0 if there was one,
+        else the seconds until the next token.
+    '''
+
+    def take(self, key, rate, burst):
+        now = self.clock()
+
+        with self._lock:
+            self._evict_idle(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(burst), now, burst / rate]
+
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _evict_idle(self, now):
+        if now < self._next_sweep:
+            return
+
+        idle = [
+            key for key, (tokens, updated_at, refill) in
+            self._buckets.items() if now - updated_at >= refill]
+        for key in idle:
+            del self._buckets[key]
+
+        self._next_sweep = now + self.SWEEP_INTERVAL
+
+
+'''
+RedisRateLimitBackend
+    a hash {tokens, updated_at} per bucket, updated by a Lua script in
+    one round trip. The buckets expire once they are full again.
+'''
+
+
+class RedisRateLimitBackend:
+
+    SCRIPT = '''
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+        local tokens = tonumber(bucket[1]) or burst
+        local updated_at = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+        local taken = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+            taken = 1
+        end
+        redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens),
+                   'updated_at', tostring(now))
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return {taken, tostring(tokens)}
+    '''
+
+    def __init__(self, client, prefix='trivia:rate:'):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(self.SCRIPT)
+
+    def take(self, key, rate, burst):
+        taken, tokens = self._script(
+            keys=[self.prefix + key], args=[rate, burst, time.time()])
+        if taken:
+            return 0
+        return (1 - float(tokens)) / rate
+
+
+'''
+create_rate_limit_backend(url)
+    returns a RedisRateLimitBackend for a redis:// url, else a
+    MemoryRateLimitBackend. The redis package is only needed
+    when a url is given.
+'''
+
+
+def create_rate_limit_backend(url=None):
+    if not url:
+        return MemoryRateLimitBackend()
+
+    import redis
+    return RedisRateLimitBackend(redis.Redis.from_url(url))
+
+
+class AdmissionControl:
+
+    def __init__(self, backend, rate_limits, concurrency_limits):
+        self.backend = backend
+        self.rate_limits = rate_limits
+        self.concurrency_limits = concurrency_limits
+        self._semaphores = {
+            endpoint_class: threading.BoundedSemaphore(limit)
+            for endpoint_class, limit in concurrency_limits.items()}
+        self._running = dict.fromkeys(concurrency_limits, 0)
+        self._lock = threading.Lock()
+
+    # client of the request, the address the connection came from
+    @staticmethod
+    def client_key():
+        return request.remote_addr or 'unknown'
+
+    def admit(self):
+        endpoint_class = ENDPOINT_CLASSES.get(request.endpoint)
+        if endpoint_class is None or request.method == 'OPTIONS':
+            return
+
+        limit = self.rate_limits.get(endpoint_class)
+        if limit is not None:
+            key = '{}:{}'.format(endpoint_class, self.client_key())
+            retry_after = self.backend.take(key, *limit)
+            if retry_after:
+                rejected_requests.inc((request.endpoint, 'rate_limit'))
+                g.retry_after = max(1, math.ceil(retry_after))
+                abort(429)
+
+        semaphore = self._semaphores.get(endpoint_class)
+        if semaphore is not None:
+            if not semaphore.acquire(blocking=False):
+                rejected_requests.inc((request.endpoint, 'concurrency'))
+                g.retry_after = RETRY_AFTER_UNAVAILABLE
+                abort(503)
+            g.admitted_class = endpoint_class
+            with self._lock:
+                self._running[endpoint_class] += 1
+
+    def release(self, error=None):
+        endpoint_class = g.pop('admitted_class', None)
+        if endpoint_class is None:
+            return
+
+        with self._lock:
+            self._running[endpoint_class] -= 1
+        self._semaphores[endpoint_class].release()
+
+    # {endpoint class: requests running}
+    def running(self):
+        with self._lock:
+            return dict(self._running)
+
+
+'''
+init_admission(app, backend)
+    admits the requests of the limited endpoints with the limits of the
+    config RATE_LIMITS and CONCURRENCY_LIMITS. Returns the
+    AdmissionControl, also kept in app.extensions['admission'].
+'''
+
+
+def init_admission(app, backend):
+    admission = AdmissionControl(
+        backend, app.config['RATE_LIMITS'], app.config['CONCURRENCY_LIMITS'])
+    app.before_request(admission.admit)
+    app.teardown_request(admission.release)
+    app.extensions['admission'] = admission
+    return admission
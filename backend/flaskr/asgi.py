@@ -0,0 +1,187 @@
+import asyncio
+import io
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from . import create_app
+from .admission import pool_connections
+
+'''
+WSGI bridge of the read path for ASGI servers
+
+    Serves GET /categories, GET /questions, GET /categories/<id>/questions,
+    GET /questions/suggest, POST /quizzes and POST /quizzes/batch with the
+    same JSON as the Flask app, which it calls as a WSGI app. The I/O of
+    the requests is not made asynchronous: SQLAlchemy 1.3 and psycopg2
+    have no async API, so every request still blocks a worker thread
+    while its Flask view runs.
+
+    What the bridge adds is the bound on those threads, one per database
+    connection of the pool. The event loop only holds the connections
+    waiting for a thread, so a burst of requests queues up there instead
+    of waiting for a connection in the pool and failing on its timeout.
+    The views, their hooks and caches are shared with the Flask app.
+
+    Run it with any ASGI server, e.g. uvicorn:
+
+    uvicorn flaskr.asgi:create_asgi_app --factory --port 5001
+'''
+
+READ_ROUTES = [
+    ('GET', re.compile(r'/categories')),
+    ('GET', re.compile(r'/questions')),
+    ('GET', re.compile(r'/categories/\d+/questions')),
+    ('GET', re.compile(r'/questions/suggest')),
+    ('POST', re.compile(r'/quizzes')),
+    ('POST', re.compile(r'/quizzes/batch'))
+]
+
+# the request bodies of the read path are small
+MAX_BODY_BYTES = 64 * 1024
+
+NOT_FOUND = (
+    b'{"error":404,"message":"resource not found","success":false}\n')
+TOO_LARGE = (
+    b'{"error":413,"message":"request entity too large","success":false}\n')
+
+
+def is_read_request(method, path):
+    # HEAD as GET, and the CORS preflight of the read routes
+    if method == 'HEAD':
+        method = 'GET'
+    return any(
+        method in (route_method, 'OPTIONS') and pattern.fullmatch(path)
+        for route_method, pattern in READ_ROUTES)
+
+
+'''
+wsgi_environ(scope, body)
+    the WSGI environ of an ASGI http scope
+'''
+
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+
+    # the whole body was read, chunked or not
+    environ['CONTENT_LENGTH'] = str(len(body))
+
+    return environ
+
+
+class AsgiApp:
+
+    def __init__(self, app, max_workers=None):
+        self.app = app
+        if max_workers is None:
+            max_workers = pool_connections(app)
+        self.executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix='trivia-asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        if not is_read_request(scope['method'], scope['path']):
+            return await self.send(send, 404, [], [NOT_FOUND])
+
+        body = await self.read_body(receive)
+        if body is None:
+            return await self.send(send, 413, [], [TOO_LARGE])
+
+        loop = asyncio.get_running_loop()
+        status, headers, chunks = await loop.run_in_executor(
+            self.executor, self.call_wsgi, wsgi_environ(scope, body))
+
+        if scope['method'] == 'HEAD':
+            chunks = []
+        await self.send(send, status, headers, chunks)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # the request body, None above MAX_BODY_BYTES
+    async def read_body(self, receive):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    # run the Flask app in a worker thread
+    def call_wsgi(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+
+        result = self.app(environ, start_response)
+        try:
+            chunks = list(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        return response['status'], response['headers'], chunks
+
+    async def send(self, send, status, headers, chunks):
+        if not headers:
+            headers = [('Content-Type', 'application/json')]
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers]
+        })
+        await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+
+
+def create_asgi_app(test_config=None, max_workers=None):
+    return AsgiApp(create_app(test_config), max_workers)
@@ -0,0 +1,343 @@
+import csv
+import io
+import json
+import time
+from itertools import islice
+
+from models import db, Question
+from .cache import category_cache
+from .events import notify
+from .conditional import mark_changed
+from .search import like_pattern
+
+'''
+Bulk import of questions
+
+    The questions are read from JSON Lines or CSV, one question per line
+    with the fields question, answer, difficulty and category
+    (the category id or its type, e.g. 2 or "Art").
+
+    They are inserted in batches, one transaction per batch.
+    On PostgreSQL a batch is copied with COPY into a temporary table and
+    moved with INSERT ... ON CONFLICT DO NOTHING, other databases
+    use executemany. Questions which already exist are skipped
+    instead of rolling back the batch.
+'''
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 10000
+
+# only the first errors are reported
+MAX_ERRORS = 20
+
+FORMATS = ('jsonl', 'csv')
+
+
+def _json_rows(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            # reported as an invalid row
+            yield error
+
+
+# rows as dictionaries from an iterable of lines
+def read_rows(lines, file_format):
+    if file_format == 'csv':
+        return csv.DictReader(lines)
+
+    return _json_rows(lines)
+
+
+# the format from a file name or a content type, jsonl by default
+def guess_format(name):
+    if name and 'csv' in name.lower():
+        return 'csv'
+    return 'jsonl'
+
+
+# {'2': 2, 'art': 2} to resolve the categories of all rows at once
+def category_ids():
+    ids = {}
+    for category_id, category_type in category_cache.get().items():
+        ids[str(category_id)] = category_id
+        ids[category_type.lower()] = category_id
+    return ids
+
+
+# a row as the values of a new question, raises ValueError if invalid
+def question_values(row, categories):
+    question = (row.get('question') or '').strip()
+    answer = (row.get('answer') or '').strip()
+    difficulty = int(row.get('difficulty'))
+    category_id = categories.get(str(row.get('category', '')).lower())
+
+    if not question or not answer:
+        raise ValueError('question and answer are required')
+    if category_id is None:
+        raise ValueError('unknown category {!r}'.format(row.get('category')))
+
+    return {
+        'question': question,
+        'answer': answer,
+        'difficulty': difficulty,
+        'category_id': category_id
+    }
+
+
+def _copy_batch(connection, batch):
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(
+            'CREATE TEMP TABLE IF NOT EXISTS questions_import ('
+            'question text, answer text, difficulty integer, '
+            'category_id integer) ON COMMIT DELETE ROWS')
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for values in batch:
+            writer.writerow([
+                values['question'], values['answer'],
+                values['difficulty'], values['category_id']])
+        buffer.seek(0)
+
+        cursor.copy_expert(
+            'COPY questions_import FROM STDIN WITH (FORMAT csv)', buffer)
+        cursor.execute(
+            'INSERT INTO questions '
+            '(question, answer, difficulty, category_id) '
+            'SELECT question, answer, difficulty, category_id '
+            'FROM questions_import ON CONFLICT (question) DO NOTHING')
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def _executemany_batch(connection, batch):
+    statement = Question.__table__.insert()
+    if connection.dialect.name == 'sqlite':
+        statement = statement.prefix_with('OR IGNORE')
+    elif connection.dialect.name == 'mysql':
+        statement = statement.prefix_with('IGNORE')
+
+    return connection.execute(statement, batch).rowcount
+
+
+# insert a batch in its own transaction, returns the inserted count.
+# the batch runs on the connection of the session, so it joins the
+# transaction the session is bound to, e.g. the one of a test.
+def insert_batch(batch):
+    connection = db.session.connection()
+    try:
+        if connection.dialect.name == 'postgresql':
+            inserted = _copy_batch(connection, batch)
+        else:
+            inserted = _executemany_batch(connection, batch)
+        if inserted:
+            mark_changed(db.session)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return inserted
+
+
+'''
+import_questions(rows, batch_size, report)
+    inserts the rows in batches and returns a summary with the totals
+    and the throughput of every batch.
+    report(batch_summary) is called after every batch when given.
+'''
+
+
+def import_questions(rows, batch_size=DEFAULT_BATCH_SIZE, report=None):
+    categories = category_ids()
+
+    summary = {
+        'rows': 0,
+        'inserted': 0,
+        'skipped': 0,
+        'invalid': 0,
+        'errors': [],
+        'batches': [],
+        'seconds': 0.0
+    }
+
+    def valid_rows():
+        for number, row in enumerate(rows, start=1):
+            summary['rows'] += 1
+            try:
+                if isinstance(row, ValueError):
+                    raise row
+                yield question_values(row, categories)
+            except (AttributeError, TypeError, ValueError) as error:
+                summary['invalid'] += 1
+                if len(summary['errors']) < MAX_ERRORS:
+                    summary['errors'].append(
+                        {'row': number, 'error': str(error)})
+
+    started = time.perf_counter()
+    values = valid_rows()
+    try:
+        while True:
+            batch = list(islice(values, batch_size))
+            if not batch:
+                break
+
+            batch_started = time.perf_counter()
+            inserted = insert_batch(batch)
+            seconds = time.perf_counter() - batch_started
+
+            batch_summary = {
+                'batch': len(summary['batches']) + 1,
+                'rows': len(batch),
+                'inserted': inserted,
+                'skipped': len(batch) - inserted,
+                'seconds': round(seconds, 4),
+                'rows_per_second': round(len(batch) / seconds, 1)
+                if seconds else None
+            }
+            summary['batches'].append(batch_summary)
+            summary['inserted'] += inserted
+            summary['skipped'] += len(batch) - inserted
+
+            if report is not None:
+                report(batch_summary)
+    finally:
+        # the rows were inserted without the session,
+        # tell the caches that the questions changed
+        if summary['batches']:
+            notify(Question)
+
+    seconds = time.perf_counter() - started
+    summary['seconds'] = round(seconds, 4)
+    summary['rows_per_second'] = round(
+        summary['rows'] / seconds, 1) if seconds else None
+
+    return summary
+
+
+'''
+Bulk changes of questions
+
+    DELETE /questions and PATCH /questions select the questions by ids,
+    by a filter, or both:
+
+    {'ids': [2, 4], 'filter': {'category': 2, 'difficulty': 1,
+     'search_term': 'title'}}
+
+    The selected questions are deleted or updated by one DELETE or
+    UPDATE statement in one transaction, without loading them.
+    The caches are told afterwards that the questions changed.
+'''
+
+# the fields of a filter, as columns of questions, and of an update
+FILTER_FIELDS = {
+    'category': Question.category_id,
+    'difficulty': Question.difficulty
+}
+UPDATE_FIELDS = ('answer', 'category', 'difficulty')
+
+
+# the query of the questions selected by the body, raises ValueError
+# if it selects nothing explicitly, so no call changes every question
+def selected_questions(body):
+    ids = body.get('ids')
+    question_filter = body.get('filter') or {}
+
+    unknown = set(question_filter) - set(FILTER_FIELDS) - {'search_term'}
+    if unknown:
+        raise ValueError('unknown filter {}'.format(', '.join(unknown)))
+    if ids is None and not question_filter:
+        raise ValueError('ids or filter are required')
+
+    query = db.session.query(Question)
+
+    if ids is not None:
+        ids = [int(question_id) for question_id in ids]
+        if len(ids) > MAX_BATCH_SIZE:
+            raise ValueError('at most {} ids'.format(MAX_BATCH_SIZE))
+        query = query.filter(Question.id.in_(ids))
+
+    for field, column in FILTER_FIELDS.items():
+        if field in question_filter:
+            query = query.filter(column == int(question_filter[field]))
+
+    term = question_filter.get('search_term')
+    if term:
+        query = query.filter(
+            Question.question.ilike(like_pattern(term), escape='\\'))
+
+    return query
+
+
+# the column values of an update, raises ValueError if invalid
+def update_values(changes):
+    unknown = set(changes) - set(UPDATE_FIELDS)
+    if unknown:
+        raise ValueError('unknown field {}'.format(', '.join(unknown)))
+    if not changes:
+        raise ValueError('no field to update')
+
+    values = {}
+    if 'answer' in changes:
+        answer = (changes['answer'] or '').strip()
+        if not answer:
+            raise ValueError('answer is required')
+        values['answer'] = answer
+    if 'difficulty' in changes:
+        values['difficulty'] = int(changes['difficulty'])
+    if 'category' in changes:
+        category_id = category_ids().get(str(changes['category']).lower())
+        if category_id is None:
+            raise ValueError(
+                'unknown category {!r}'.format(changes['category']))
+        values['category_id'] = category_id
+    return values
+
+
+def _execute(change):
+    try:
+        count = change()
+        if count:
+            mark_changed(db.session)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # the statement ran without the session,
+    # tell the caches that the questions changed
+    if count:
+        notify(Question)
+    return count
+
+
+'''
+delete_questions(body)
+    deletes the questions selected by the body, returns their number.
+    Raises ValueError if the body is invalid.
+'''
+
+
+def delete_questions(body):
+    query = selected_questions(body)
+    return _execute(lambda: query.delete(synchronize_session=False))
+
+
+'''
+update_questions(body)
+    sets the fields of body['set'] of the questions selected by the body,
+    returns their number. Raises ValueError if the body is invalid.
+'''
+
+
+def update_questions(body):
+    query = selected_questions(body)
+    values = update_values(body.get('set') or {})
+    return _execute(
+        lambda: query.update(values, synchronize_session=False))
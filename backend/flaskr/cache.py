@@ -0,0 +1,159 @@
+import threading
+
+from models import Category
+from .events import on_change
+
+'''
+LoadedCache
+    base of the in-process caches of data loaded from the database at
+    once and kept until it changes. get() returns the data, loaded by
+    load() first if needed, invalidate() drops it. Every invalidation
+    bumps the version, data loaded while the version changed is not
+    kept: it could have been read before the change.
+'''
+
+
+class LoadedCache:
+
+    def __init__(self):
+        # bumped on every invalidation
+        self.version = 0
+        self._value = None
+        self._lock = threading.Lock()
+
+    # the returned data is shared, do not modify it
+    def get(self):
+        value = self._value
+        if value is not None:
+            return value
+        return self._load()
+
+    def _load(self):
+        with self._lock:
+            version = self.version
+
+        value = self.load()
+
+        # do not keep the data if it changed meanwhile
+        with self._lock:
+            if self._keeps(version):
+                self._value = value
+
+        return value
+
+    # whether data loaded at the version is kept, called in the lock
+    def _keeps(self, version):
+        return version == self.version
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._value = None
+
+    def load(self):
+        raise NotImplementedError
+
+
+'''
+CategoryCache
+    keeps the dictionary of categories {id: type} in memory.
+    Categories almost never change, so they are loaded once and
+    served from memory until a Category is inserted, updated or deleted.
+'''
+
+
+class CategoryCache(LoadedCache):
+
+    def __init__(self):
+        super().__init__()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self):
+        if self._value is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return super().get()
+
+    def load(self):
+        all_categories = Category.query.order_by(Category.id).all()
+        categories = {}
+        for category in all_categories:
+            categories[category.id] = category.type
+        return categories
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'version': self.version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / requests if requests else 0.0
+        }
+
+
+category_cache = CategoryCache()
+on_change(Category, category_cache.invalidate)
+
+
+'''
+IncrementalIndex
+    base of the in-process indexes of the questions which are loaded at
+    once and then kept up to date question by question.
+    invalidate(rows) marks the ids of the changed rows stale, or drops
+    the whole index when the rows are not known. get() returns the
+    index, loaded or refreshed first if needed. As for a LoadedCache, a
+    load or a refresh read while the version changed is not kept: an
+    older read could otherwise be applied after a newer one.
+
+    Subclasses implement, for the index they keep:
+    - load(): the index read from the database
+    - read(ids): the current rows of the questions of the ids
+    - apply(index, ids, rows): moves the questions of the ids to their
+      current rows, a deleted question has no row. Called in the lock.
+    and read the index in the lock.
+'''
+
+
+class IncrementalIndex(LoadedCache):
+
+    def __init__(self):
+        super().__init__()
+        # ids of the changed questions, not yet re-read
+        self._stale_ids = set()
+
+    def invalidate(self, rows=None):
+        with self._lock:
+            self.version += 1
+            ids = {row.get('id') for row in rows} if rows else {None}
+            if None in ids or self._value is None:
+                self._value = None
+                self._stale_ids = set()
+            else:
+                self._stale_ids.update(ids)
+
+    def get(self):
+        with self._lock:
+            version = self.version
+            index = self._value
+            stale_ids = self._stale_ids
+        if index is None:
+            return self._load()
+        if not stale_ids:
+            return index
+
+        rows = self.read(stale_ids)
+        with self._lock:
+            # the ids stay stale for the next call if they changed again,
+            # or were refreshed by another call meanwhile
+            if version == self.version and stale_ids is self._stale_ids:
+                self.apply(index, stale_ids, rows)
+                self._stale_ids = set()
+        return index
+
+    def read(self, ids):
+        raise NotImplementedError
+
+    def apply(self, index, ids, rows):
+        raise NotImplementedError
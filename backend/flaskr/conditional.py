@@ -0,0 +1,158 @@
+import hashlib
+import threading
+import time
+
+from flask import request
+from sqlalchemy import event, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question, Category
+from .events import notify
+from .migrations import data_version as data_version_table
+
+'''
+HTTP conditional requests
+
+    DataVersion is the version of the questions and categories, shared
+    by all processes through the row of the table data_version. Every
+    transaction changing them bumps the row before it commits, so the
+    new version becomes visible together with the data. The writers
+    queue on the row from their commit until it is done.
+
+    Every process reads the shared version at most once per
+    DATA_VERSION_INTERVAL seconds, at the start of a request. A version
+    changed by another process drops all the in-process caches. A commit
+    of the process itself is adopted at once, its caches were already
+    told which rows changed.
+
+    The read endpoints send a strong ETag built from the version and
+    answer If-None-Match with 304 Not Modified, so a response changed
+    by another process is not confirmed for longer than the interval.
+    Without the table, e.g. on a database not migrated yet, no ETag is
+    sent.
+'''
+
+# endpoints answering conditional requests
+CONDITIONAL_ENDPOINTS = {
+    'get_categories',
+    'get_questions',
+    'get_questions_from_category',
+    'get_stats',
+    'suggest_questions'
+}
+
+# seconds between two reads of the shared version
+DEFAULT_INTERVAL = 1.0
+
+
+class DataVersion:
+
+    def __init__(self, interval=DEFAULT_INTERVAL, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self.value = None
+        self._synced_at = None
+        self._lock = threading.Lock()
+
+    # forget the version, e.g. of a previously bound database
+    def reset(self):
+        with self._lock:
+            self.value = None
+            self._synced_at = None
+
+    '''
+    sync()
+        reads the shared version unless it was read less than interval
+        seconds ago. If another process changed it, the caches of the
+        questions and categories are dropped.
+    '''
+
+    def sync(self):
+        now = self.clock()
+        synced_at = self._synced_at
+        if synced_at is not None and now - synced_at < self.interval:
+            return
+
+        try:
+            value = db.session.execute(
+                select([data_version_table.c.value])).scalar()
+        except SQLAlchemyError:
+            db.session.rollback()
+            value = None
+
+        with self._lock:
+            changed = synced_at is not None and value != self.value
+            self.value = value
+            self._synced_at = now
+
+        if changed:
+            notify(Category)
+            notify(Question)
+
+    # adopt the version committed by the process, if no other process
+    # committed in between, else read it again with the next request
+    def committed(self, value):
+        with self._lock:
+            if self.value is not None and value == self.value + 1:
+                self.value = value
+            else:
+                self._synced_at = float('-inf')
+
+
+data_version = DataVersion()
+
+
+'''
+mark_changed(session)
+    tells that the transaction of the session changes questions or
+    categories without the session, e.g. by a bulk statement
+'''
+
+
+def mark_changed(session):
+    session.info['data_changed'] = True
+
+
+# bump the shared version in the transaction changing the data.
+# the changes of the flushes are kept by flaskr.events, whose listeners
+# were registered first.
+@event.listens_for(db.session, 'before_commit')
+def _bump_data_version(session):
+    session.flush()
+    if not session.info.get('changed_rows') and \
+            not session.info.get('data_changed'):
+        return
+
+    connection = session.connection()
+    connection.execute(data_version_table.update().values(
+        value=data_version_table.c.value + 1))
+    session.info['data_version'] = connection.execute(
+        select([data_version_table.c.value])).scalar()
+
+
+@event.listens_for(db.session, 'after_commit')
+def _commit_data_version(session):
+    session.info.pop('data_changed', None)
+    value = session.info.pop('data_version', None)
+    if value is not None:
+        data_version.committed(value)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _rollback_data_version(session):
+    session.info.pop('data_changed', None)
+    session.info.pop('data_version', None)
+
+
+# the ETag of the current request at the current data version,
+# None while the version is unknown
+def current_etag():
+    if data_version.value is None:
+        return None
+    digest = hashlib.sha1(request.full_path.encode()).hexdigest()[:16]
+    return '{}-{}'.format(data_version.value, digest)
+
+
+def is_conditional_request():
+    return request.method in ('GET', 'HEAD') and \
+        request.endpoint in CONDITIONAL_ENDPOINTS
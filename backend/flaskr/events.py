@@ -0,0 +1,118 @@
+import logging
+from itertools import chain
+
+from sqlalchemy import event, inspect
+
+from models import db, record_write
+
+'''
+Change notifications for in-process caches.
+
+Callbacks are registered per model with on_change(). They are called
+when rows of that model are flushed and once more when the transaction
+commits or rolls back, so a cache can never keep data that was read
+from a transaction which did not make it to the database.
+
+Callbacks registered with on_rows_change() also receive the changed
+rows, as dictionaries of column values. An updated row is given twice,
+with its new and with its previous values. The rows are None when they
+are not known, e.g. after a bulk statement.
+
+The callbacks run inside the flush, so an exception of a callback is
+logged instead of failing the write. A row callback which fails is
+called again without the rows, to drop everything it kept.
+'''
+
+logger = logging.getLogger(__name__)
+
+# {model: [callback, callback]}
+_callbacks = {}
+_row_callbacks = {}
+
+
+def on_change(model, callback):
+    _callbacks.setdefault(model, []).append(callback)
+
+
+def on_rows_change(model, callback):
+    _row_callbacks.setdefault(model, []).append(callback)
+
+
+# call every callback registered for the model
+def notify(model, rows=None):
+    # the reads stay on the primary until the replica caught up
+    record_write()
+
+    for callback in _callbacks.get(model, []):
+        try:
+            callback()
+        except Exception:
+            logger.exception('change callback %r failed', callback)
+    for callback in _row_callbacks.get(model, []):
+        try:
+            callback(rows)
+        except Exception:
+            logger.exception('change callback %r failed', callback)
+            if rows is not None:
+                try:
+                    callback(None)
+                except Exception:
+                    logger.exception(
+                        'change callback %r failed', callback)
+
+
+# the column values of an instance, before and after an update
+def row_values(instance):
+    state = inspect(instance)
+    values = {}
+    previous = {}
+
+    for attribute in state.mapper.column_attrs:
+        values[attribute.key] = state.dict.get(attribute.key)
+        history = state.attrs[attribute.key].history
+        if history.deleted:
+            previous[attribute.key] = history.deleted[0]
+
+    if previous:
+        return [values, dict(values, **previous)]
+    return [values]
+
+
+def _changed_rows(session):
+    # {model: [rows]}
+    changed = {}
+    models = set(_callbacks) | set(_row_callbacks)
+
+    # skip the instances whose collections changed only,
+    # e.g. the category of a new question
+    dirty = [
+        instance for instance in session.dirty
+        if session.is_modified(instance, include_collections=False)]
+
+    for instance in chain(session.new, dirty, session.deleted):
+        for model in models:
+            if isinstance(instance, model):
+                rows = changed.setdefault(model, [])
+                if model in _row_callbacks:
+                    rows.extend(row_values(instance))
+
+    return changed
+
+
+@event.listens_for(db.session, 'after_flush')
+def _after_flush(session, flush_context):
+    changed = _changed_rows(session)
+    for model, rows in changed.items():
+        notify(model, rows)
+
+    # remember the rows until the transaction ends
+    pending = session.info.setdefault('changed_rows', {})
+    for model, rows in changed.items():
+        pending.setdefault(model, []).extend(rows)
+
+
+@event.listens_for(db.session, 'after_commit')
+@event.listens_for(db.session, 'after_rollback')
+def _after_transaction(session):
+    for model, rows in session.info.pop('changed_rows', {}).items():
+        notify(model, rows)
@@ -0,0 +1,63 @@
+import csv
+import io
+
+from models import Question, FORMAT_FIELDS
+from . import serializer
+
+'''
+Streaming export of the question bank
+
+    The questions are read through a server-side cursor, a batch of
+    EXPORT_BATCH_SIZE rows at a time, and written out as they arrive,
+    so the memory stays flat whatever the size of the table.
+    The rows are read as tuples, without building ORM objects.
+'''
+
+EXPORT_BATCH_SIZE = 1000
+
+CSV_FIELDS = list(FORMAT_FIELDS)
+
+# {format: mimetype}
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+
+def exported_questions(category_id=None):
+    query = Question.rows().order_by(Question.id)
+    if category_id is not None:
+        query = query.filter(Question.category_id == category_id)
+
+    # yield_per streams the rows with a server-side cursor
+    return query.yield_per(EXPORT_BATCH_SIZE)
+
+
+def ndjson_lines(questions):
+    for question in questions:
+        yield serializer.dumps(question.format())
+
+
+# the rows are in the order of CSV_FIELDS
+def csv_lines(questions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+
+    for question in questions:
+        writer.writerow(question)
+        # hand over the lines and reuse the buffer
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # the header of an empty export
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_lines(file_format, category_id=None):
+    questions = exported_questions(category_id)
+    if file_format == 'csv':
+        return csv_lines(questions)
+    return ndjson_lines(questions)
@@ -0,0 +1,291 @@
+import json
+import logging
+import threading
+import time
+
+from flask import g, request, has_request_context, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.exceptions import HTTPException
+
+from . import serializer
+
+'''
+Per-request instrumentation
+
+    For every request the number of SQL statements, the time spent in
+    the database, the JSON serialization time, the time of the view and
+    the time of the whole request, hooks included, are recorded. They
+    are sent back in a Server-Timing header, logged as one JSON line on
+    the 'flaskr.requests' logger and aggregated in histograms, served at
+    /metrics in the Prometheus text format.
+'''
+
+logger = logging.getLogger('flaskr.requests')
+
+# seconds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                    0.5, 1.0, 2.5, 5.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+def _labels(names, values):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('"', '\\"'))
+        for name, value in zip(names, values))
+
+
+class Histogram:
+
+    def __init__(self, name, description, labels, buckets):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # {label values: [count per bucket, sum, count]}
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, values, value):
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [
+                    [0] * len(self.buckets), 0.0, 0]
+            for i, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.description),
+            '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            for values, (counts, total, count) in sorted(
+                    self._series.items()):
+                labels = _labels(self.labels, values)
+                for bucket, bucket_count in zip(self.buckets, counts):
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                        self.name, labels, bucket, bucket_count))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(
+                    self.name, labels, count))
+                lines.append('{}_sum{{{}}} {}'.format(
+                    self.name, labels, total))
+                lines.append('{}_count{{{}}} {}'.format(
+                    self.name, labels, count))
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, description, labels):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, values, amount=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.description),
+            '# TYPE {} counter'.format(self.name)]
+        with self._lock:
+            for values, value in sorted(self._values.items()):
+                lines.append('{}{{{}}} {}'.format(
+                    self.name, _labels(self.labels, values), value))
+        return lines
+
+
+request_duration = Histogram(
+    'trivia_request_duration_seconds', 'Time spent handling the request.',
+    ('endpoint', 'method', 'status'), DURATION_BUCKETS)
+view_duration = Histogram(
+    'trivia_view_duration_seconds', 'Time spent in the view function.',
+    ('endpoint',), DURATION_BUCKETS)
+db_duration = Histogram(
+    'trivia_db_duration_seconds', 'Time spent in SQL statements.',
+    ('endpoint',), DURATION_BUCKETS)
+serialization_duration = Histogram(
+    'trivia_serialization_duration_seconds', 'Time spent encoding JSON.',
+    ('endpoint',), DURATION_BUCKETS)
+sql_statements = Histogram(
+    'trivia_sql_statements', 'SQL statements run per request.',
+    ('endpoint',), STATEMENT_BUCKETS)
+handler_exceptions = Counter(
+    'trivia_handler_exceptions_total',
+    'Exceptions turned into an error response by a handler.',
+    ('endpoint', 'exception'))
+rejected_requests = Counter(
+    'trivia_rejected_requests_total',
+    'Requests rejected by the rate limit or the concurrency cap.',
+    ('endpoint', 'reason'))
+
+METRICS = [request_duration, view_duration, db_duration,
+           serialization_duration, sql_statements, handler_exceptions,
+           rejected_requests]
+
+
+def current_metrics():
+    if has_request_context():
+        return g.get('request_metrics')
+    return None
+
+
+# the start of a statement is kept on its execution context, which is
+# dropped with it, also when the statement fails. The few statements run
+# without a context, e.g. to fetch a default, are counted but not timed.
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started = getattr(context, 'query_started', None)
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics['sql_statements'] += 1
+        if started is not None:
+            metrics['db_seconds'] += time.perf_counter() - started
+
+
+# flask.jsonify with the serializer in use,
+# recording the serialization time of the request
+def jsonify(*args, **kwargs):
+    if args and kwargs:
+        raise TypeError('jsonify() takes either args or kwargs, not both')
+    data = args[0] if len(args) == 1 else args or kwargs
+
+    started = time.perf_counter()
+    response = current_app.response_class(
+        serializer.dumps(data), mimetype='application/json')
+
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics['serialization_seconds'] += time.perf_counter() - started
+
+    return response
+
+
+'''
+log_swallowed_exception(error)
+    the handlers turn any exception into an error response with abort().
+    Called by the error handlers, it logs and counts the original
+    exception, which is the context of the HTTP error. Behind a client
+    error it is mostly invalid input, logged as a warning without its
+    traceback; behind a server error it is logged with its traceback.
+'''
+
+
+def log_swallowed_exception(error):
+    # an unhandled exception is logged by Flask already
+    if not isinstance(error, HTTPException):
+        return
+
+    original = error.__context__
+    if original is None or isinstance(original, HTTPException):
+        return
+
+    handler_exceptions.inc((request.endpoint, type(original).__name__))
+    if error.code is not None and error.code < 500:
+        logger.warning(
+            '%s %s failed with %s: %s: %s', request.method, request.path,
+            error.code, type(original).__name__, original)
+    else:
+        logger.error(
+            '%s %s failed', request.method, request.path,
+            exc_info=(type(original), original, original.__traceback__))
+
+
+def start_request():
+    g.request_metrics = {
+        'started': time.perf_counter(),
+        'view_seconds': 0.0,
+        'sql_statements': 0,
+        'db_seconds': 0.0,
+        'serialization_seconds': 0.0
+    }
+
+
+def finish_request(response):
+    metrics = g.pop('request_metrics', None)
+    if metrics is None:
+        return response
+
+    seconds = time.perf_counter() - metrics['started']
+    endpoint = request.endpoint or 'unknown'
+
+    response.headers['Server-Timing'] = (
+        'db;dur={:.3f};desc="{} queries", serialization;dur={:.3f}, '
+        'view;dur={:.3f}, total;dur={:.3f}'.format(
+            metrics['db_seconds'] * 1000, metrics['sql_statements'],
+            metrics['serialization_seconds'] * 1000,
+            metrics['view_seconds'] * 1000, seconds * 1000))
+
+    request_duration.observe(
+        (endpoint, request.method, response.status_code), seconds)
+    view_duration.observe((endpoint,), metrics['view_seconds'])
+    db_duration.observe((endpoint,), metrics['db_seconds'])
+    serialization_duration.observe(
+        (endpoint,), metrics['serialization_seconds'])
+    sql_statements.observe((endpoint,), metrics['sql_statements'])
+
+    logger.info(json.dumps({
+        'method': request.method,
+        'path': request.path,
+        'endpoint': endpoint,
+        'status': response.status_code,
+        'duration_ms': round(seconds * 1000, 3),
+        'view_ms': round(metrics['view_seconds'] * 1000, 3),
+        'db_ms': round(metrics['db_seconds'] * 1000, 3),
+        'sql_statements': metrics['sql_statements'],
+        'serialization_ms': round(metrics['serialization_seconds'] * 1000, 3)
+    }))
+
+    return response
+
+
+'''
+render_metrics(gauges)
+    all metrics in the Prometheus text format, followed by the gauges
+    given as {name: value}
+'''
+
+
+def render_metrics(gauges=None):
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for name, value in sorted((gauges or {}).items()):
+        lines.append('# TYPE {} gauge'.format(name))
+        lines.append('{} {}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app):
+    app.before_request(start_request)
+    app.after_request(finish_request)
+
+    # the time of the view alone, without the hooks before and after it.
+    # a response of a before_request hook, e.g. 304, has no view time.
+    dispatch_request = app.dispatch_request
+
+    def timed_dispatch_request():
+        started = time.perf_counter()
+        try:
+            return dispatch_request()
+        finally:
+            metrics = current_metrics()
+            if metrics is not None:
+                metrics['view_seconds'] += time.perf_counter() - started
+
+    app.dispatch_request = timed_dispatch_request
@@ -0,0 +1,184 @@
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, DateTime, ForeignKey)
+from sqlalchemy import select, inspect
+
+'''
+Versioned migrations of the database schema
+
+    The schema is no longer created when the app starts. It is brought
+    up to date once, before deploying or testing, with:
+
+    flask init-db
+
+    Every migration runs in its own transaction together with the row
+    recording its version in the table schema_version, so a failed
+    migration is retried by the next run. New migrations are appended
+    to MIGRATIONS with the next version, the applied ones never change.
+    So they define the tables they create themselves, as they were at
+    that version, instead of taking them from the models.
+'''
+
+Migration = namedtuple('Migration', ['version', 'description', 'apply'])
+
+metadata = MetaData()
+
+schema_version = Table(
+    'schema_version', metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String),
+    Column('applied_at', DateTime))
+
+# the shared version of the questions and categories, one row bumped by
+# every transaction changing them, see flaskr.conditional
+data_version = Table(
+    'data_version', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('value', Integer, nullable=False))
+
+
+# the categories and questions tables of the first schema
+original_metadata = MetaData()
+
+Table(
+    'categories', original_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('type', String, unique=True))
+
+Table(
+    'questions', original_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('question', String, unique=True),
+    Column('answer', String),
+    Column('difficulty', Integer),
+    Column('category_id', Integer,
+           ForeignKey('categories.id', ondelete='CASCADE'), nullable=True))
+
+
+def create_tables(connection):
+    if 'questions' in inspect(connection).get_table_names():
+        convert_restored_tables(connection)
+    original_metadata.create_all(connection, checkfirst=True)
+
+
+# the tables restored from trivia.psql, on PostgreSQL, have a column
+# category instead of category_id, set to NULL when its category is
+# deleted, and no unique constraints. They are brought to the first
+# schema, keeping their rows.
+def convert_restored_tables(connection):
+    columns = {
+        column['name']
+        for column in inspect(connection).get_columns('questions')}
+    if 'category' not in columns:
+        return
+
+    connection.execute(
+        'ALTER TABLE questions RENAME COLUMN category TO category_id')
+    connection.execute(
+        'ALTER TABLE questions DROP CONSTRAINT IF EXISTS category')
+    connection.execute(
+        'ALTER TABLE questions ADD CONSTRAINT questions_category_id_fkey '
+        'FOREIGN KEY (category_id) REFERENCES categories (id) '
+        'ON DELETE CASCADE')
+    connection.execute(
+        'ALTER TABLE questions ADD CONSTRAINT questions_question_key '
+        'UNIQUE (question)')
+    connection.execute(
+        'ALTER TABLE categories ADD CONSTRAINT categories_type_key '
+        'UNIQUE (type)')
+
+
+# the index of the listing order, seeked by the cursor pagination
+def create_category_id_index(connection):
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS ix_questions_category_id_id '
+        'ON questions (category_id, id)')
+
+
+# on PostgreSQL, the GIN trigram index used to search the questions
+# with ILIKE '%term%' without scanning the whole table.
+# The other databases are searched with an in-process index.
+def create_search_index(connection):
+    if connection.dialect.name != 'postgresql':
+        return
+
+    connection.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS ix_questions_question_trgm '
+        'ON questions USING gin (question gin_trgm_ops)')
+
+
+# the index of the cursor pagination, the questions without a category
+# first as in flaskr.pagination
+def create_listing_index(connection):
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS ix_questions_listing '
+        'ON questions ((coalesce(category_id, -1)), id)')
+
+
+# the row of the data version, read by every process
+def create_data_version(connection):
+    data_version.create(connection, checkfirst=True)
+    connection.execute(data_version.insert().values(id=1, value=0))
+
+
+MIGRATIONS = [
+    Migration(1, 'create the categories and questions tables',
+              create_tables),
+    Migration(2, 'index questions by (category_id, id)',
+              create_category_id_index),
+    Migration(3, 'trigram index of the questions', create_search_index),
+    Migration(4, 'shared data version', create_data_version),
+    Migration(5, 'index questions by (coalesce(category_id, -1), id)',
+              create_listing_index)
+]
+
+
+def current_version(engine):
+    with engine.begin() as connection:
+        schema_version.create(connection, checkfirst=True)
+        version = connection.execute(
+            select([schema_version.c.version]).order_by(
+                schema_version.c.version.desc()).limit(1)).scalar()
+    return version or 0
+
+
+def pending_migrations(engine):
+    version = current_version(engine)
+    return [
+        migration for migration in MIGRATIONS if migration.version > version]
+
+
+'''
+migrate(engine, report)
+    applies the pending migrations in order, calling report(step) after
+    each of them. Returns the steps as
+    {'version', 'description', 'seconds'}
+'''
+
+
+def migrate(engine, report=None):
+    steps = []
+
+    for migration in pending_migrations(engine):
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            migration.apply(connection)
+            connection.execute(schema_version.insert().values(
+                version=migration.version,
+                description=migration.description,
+                applied_at=datetime.utcnow()))
+
+        step = {
+            'version': migration.version,
+            'description': migration.description,
+            'seconds': round(time.perf_counter() - started, 3)
+        }
+        steps.append(step)
+        if report is not None:
+            report(step)
+
+    return steps
@@ -0,0 +1,118 @@
+import base64
+import binascii
+
+from flask import request, abort
+from sqlalchemy import func, literal_column, tuple_
+
+from models import Question
+
+'''
+Keyset (cursor) pagination
+
+    ?after=<cursor>&limit=N seeks directly to the questions after
+    the cursor using the index over (category_id, id), instead of
+    OFFSET/LIMIT which has to walk over all the previous pages.
+    The cursor is opaque for the clients, it encodes "category_id,id"
+    of the last question of the previous page.
+
+    The questions without a category come first, their category_id is
+    NULL_CATEGORY in the cursor and in the order, which is seeked with
+    the index over (coalesce(category_id, -1), id). The questions of one
+    category are ordered and seeked on the columns (category_id, id).
+'''
+
+MAX_LIMIT = 100
+
+# the category_id of the questions without a category
+NULL_CATEGORY = -1
+
+# the listing order, NULL categories included. NULL_CATEGORY is
+# rendered as a literal, a bound parameter would not match the index.
+category_key = func.coalesce(
+    Question.category_id, literal_column(str(NULL_CATEGORY)))
+
+
+def is_cursor_request():
+    return 'after' in request.args or 'limit' in request.args
+
+
+def encode_cursor(question):
+    category_id = question.category_id
+    if category_id is None:
+        category_id = NULL_CATEGORY
+    key = '{},{}'.format(category_id, question.id)
+    # strip the padding to keep the cursor url friendly
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+
+# returns (category_id, id), raises ValueError for an invalid cursor
+def decode_cursor(cursor):
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        key = base64.urlsafe_b64decode((cursor + padding).encode()).decode()
+        category_id, question_id = key.split(',')
+        return int(category_id), int(question_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError('invalid cursor {!r}'.format(cursor))
+
+
+'''
+paginate_by_cursor(query, default_limit, count, category_id)
+    reads after, limit and total from the request arguments and returns
+    (questions, next_cursor, total_questions).
+    With category_id the questions are those of the category, listed in
+    the order of the index over (category_id, id).
+    total_questions is None unless the client asks for it with total=true,
+    the COUNT(*) is the expensive part on a large table. It is taken from
+    count() if given.
+    next_cursor is None on the last page.
+'''
+
+
+def paginate_by_cursor(query, default_limit, count=None, category_id=None):
+    limit = request.args.get('limit', default_limit, type=int)
+    if limit < 1 or limit > MAX_LIMIT:
+        abort(400)
+
+    if category_id is not None:
+        query = query.filter(Question.category_id == category_id)
+
+    total_questions = None
+    if request.args.get('total', '').lower() in ('1', 'true'):
+        if count is None:
+            count = query.order_by(None).count
+        total_questions = count()
+
+    after = request.args.get('after')
+    if after:
+        try:
+            after_category_id, question_id = decode_cursor(after)
+        except ValueError:
+            abort(400)
+
+        if category_id is None:
+            # the first condition lets SQLite seek the index on the
+            # expression
+            query = query.filter(
+                category_key >= after_category_id,
+                tuple_(category_key, Question.id) >
+                tuple_(after_category_id, question_id))
+        elif after_category_id == category_id:
+            query = query.filter(Question.id > question_id)
+        else:
+            # a cursor of another listing
+            abort(400)
+
+    # fetch one more question to know if there is a next page
+    if category_id is None:
+        query = query.order_by(category_key, Question.id)
+    else:
+        query = query.order_by(Question.category_id, Question.id)
+    questions = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(questions) > limit:
+        questions = questions[:limit]
+        next_cursor = encode_cursor(questions[-1])
+
+    return questions, next_cursor, total_questions
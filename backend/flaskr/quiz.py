@@ -0,0 +1,281 @@
+import random
+from bisect import bisect_left
+
+from models import db, Question
+from .events import on_rows_change
+from .cache import IncrementalIndex
+
+'''
+pick(deck, previous_ids)
+    returns a uniformly random id of the sorted ids of the deck which is
+    not in previous_ids, None if all of them were asked. Used by the
+    quiz pack, whose decks are sorted arrays.
+    Costs O(m log n) for m previous questions, so it does not
+    depend on the size of the deck.
+'''
+
+
+def pick(deck, previous_ids, rng=random):
+    # positions of the previous questions in the deck
+    skipped = set()
+    for question_id in previous_ids:
+        position = bisect_left(deck, question_id)
+        if position < len(deck) and deck[position] == question_id:
+            skipped.add(position)
+
+    remaining = len(deck) - len(skipped)
+    if remaining <= 0:
+        return None
+
+    # choose the n-th unseen question, then step over
+    # the previous questions in front of it
+    position = rng.randrange(remaining)
+    for skipped_position in sorted(skipped):
+        if skipped_position <= position:
+            position += 1
+        else:
+            break
+
+    return deck[position]
+
+
+'''
+IdPool
+    question ids in a list, with the position of every id,
+    to add, remove and draw an id in O(1)
+'''
+
+
+class IdPool:
+
+    def __init__(self):
+        self.ids = []
+        self._positions = {}
+
+    def add(self, question_id):
+        if question_id not in self._positions:
+            self._positions[question_id] = len(self.ids)
+            self.ids.append(question_id)
+
+    # move the last id into the place of the removed one
+    def remove(self, question_id):
+        position = self._positions.pop(question_id, None)
+        if position is None:
+            return
+
+        last = self.ids.pop()
+        if position < len(self.ids):
+            self.ids[position] = last
+            self._positions[last] = position
+
+    def choice(self, rng=random):
+        return self.ids[int(rng.random() * len(self.ids))]
+
+    def __contains__(self, question_id):
+        return question_id in self._positions
+
+    def __len__(self):
+        return len(self.ids)
+
+
+'''
+AliasTable
+    draws one of the items with the probability of its weight in O(1),
+    after building the table in O(k) for k items (Vose's alias method)
+'''
+
+
+class AliasTable:
+
+    def __init__(self, items, weights):
+        self.items = items
+        total = float(sum(weights))
+        scaled = [weight * len(items) / total for weight in weights]
+        self._probabilities = [1.0] * len(items)
+        self._aliases = list(range(len(items)))
+
+        small = [i for i, weight in enumerate(scaled) if weight < 1.0]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self._probabilities[less] = scaled[less]
+            self._aliases[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+
+    def draw(self, rng=random):
+        i = int(rng.random() * len(self.items))
+        if rng.random() < self._probabilities[i]:
+            return self.items[i]
+        return self.items[self._aliases[i]]
+
+
+'''
+QuizEngine
+    keeps an IdPool of the question ids of every (category, difficulty),
+    loaded at once. A changed question is only moved between the pools,
+    re-read on the next draw, instead of reloading all of them.
+    It serves the quizzes of POST /quizzes, of the quiz sessions and of
+    the generated quizzes, unless a quiz pack is loaded.
+'''
+
+
+class QuizEngine(IncrementalIndex):
+
+    # random draws from a pool before scanning it for an unseen question
+    MAX_REJECTIONS = 8
+
+    # the index is ({(category_id, difficulty): IdPool},
+    # {question id: (category_id, difficulty)})
+    def load(self):
+        pools = {}
+        keys = {}
+        query = db.session.query(
+            Question.id, Question.category_id, Question.difficulty)
+        for question_id, category_id, difficulty in query:
+            key = (category_id, difficulty)
+            pools.setdefault(key, IdPool()).add(question_id)
+            keys[question_id] = key
+        return pools, keys
+
+    def read(self, ids):
+        return db.session.query(
+            Question.id, Question.category_id, Question.difficulty).filter(
+            Question.id.in_(ids)).all()
+
+    # move the changed questions to their current pool
+    def apply(self, index, ids, rows):
+        pools, keys = index
+        for question_id in ids:
+            key = keys.pop(question_id, None)
+            if key is not None:
+                pools[key].remove(question_id)
+        for question_id, category_id, difficulty in rows:
+            key = (category_id, difficulty)
+            pools.setdefault(key, IdPool()).add(question_id)
+            keys[question_id] = key
+
+    '''
+    generate(count, category_weights, difficulty_weights, previous_ids)
+        returns the ids of up to count distinct random questions,
+        none of them in previous_ids.
+        category_weights {category_id: weight} gives the share of the
+        questions drawn from every category, difficulty_weights
+        {difficulty: weight} the share of every difficulty within a
+        category. Without weights the questions are drawn in proportion
+        to the number of questions. A missing key has the weight 0.
+        The shares are set at the start of the quiz, every draw then
+        costs O(1).
+    '''
+
+    def generate(self, count, category_weights=None, difficulty_weights=None,
+                 previous_ids=(), rng=random):
+        pools, keys = self.get()
+
+        with self._lock:
+            excluded = set(previous_ids)
+
+            # the questions of every pool which may still be drawn
+            available = {key: len(pool) for key, pool in pools.items()}
+            for question_id in excluded:
+                key = keys.get(question_id)
+                if key is not None:
+                    available[key] -= 1
+
+            question_ids = []
+            table = None
+            while len(question_ids) < count:
+                if table is None:
+                    table = self._alias_table(
+                        available, category_weights, difficulty_weights)
+                    if table is None:
+                        break
+
+                key = table.draw(rng)
+                question_id = self._draw(pools[key], excluded, rng)
+                question_ids.append(question_id)
+                excluded.add(question_id)
+
+                # an exhausted pool is left out of the next draws
+                available[key] -= 1
+                if available[key] == 0:
+                    table = None
+
+        return question_ids
+
+    '''
+    pick(category_id, previous_ids)
+        returns the id of a uniformly random question of the category,
+        of any category for 0, which is not in previous_ids, None if all
+        of them were asked. Like QuizPack.pick().
+    '''
+
+    def pick(self, category_id, previous_ids, rng=random):
+        category_weights = None if category_id == 0 else {category_id: 1}
+        question_ids = self.generate(
+            1, category_weights, previous_ids=previous_ids, rng=rng)
+        return question_ids[0] if question_ids else None
+
+    # the sorted question ids of the category, of all questions for 0
+    def deck(self, category_id):
+        pools, keys = self.get()
+        with self._lock:
+            return sorted(
+                question_id
+                for (pool_category_id, difficulty), pool in pools.items()
+                if category_id == 0 or pool_category_id == category_id
+                for question_id in pool.ids)
+
+    @staticmethod
+    def _alias_table(available, category_weights, difficulty_weights):
+        # {category_id: {difficulty: available questions}}
+        categories = {}
+        for (category_id, difficulty), size in available.items():
+            if size > 0:
+                categories.setdefault(category_id, {})[difficulty] = size
+
+        def share(weights, key, size):
+            if weights is None:
+                return size
+            return weights.get(key, 0)
+
+        keys = []
+        weights = []
+        for category_id, difficulties in categories.items():
+            category_weight = share(
+                category_weights, category_id, sum(difficulties.values()))
+            total = sum(
+                share(difficulty_weights, difficulty, size)
+                for difficulty, size in difficulties.items())
+            if category_weight <= 0 or total <= 0:
+                continue
+
+            for difficulty, size in difficulties.items():
+                weight = share(difficulty_weights, difficulty, size)
+                if weight > 0:
+                    keys.append((category_id, difficulty))
+                    weights.append(category_weight * weight / total)
+
+        if not keys:
+            return None
+        return AliasTable(keys, weights)
+
+    # a random id of the pool not in excluded, which holds at least one
+    def _draw(self, pool, excluded, rng):
+        for i in range(self.MAX_REJECTIONS):
+            question_id = pool.choice(rng)
+            if question_id not in excluded:
+                return question_id
+
+        # most of the pool was drawn already
+        return rng.choice([
+            question_id for question_id in pool.ids
+            if question_id not in excluded])
+
+
+quiz_engine = QuizEngine()
+on_rows_change(Question, quiz_engine.invalidate)
@@ -0,0 +1,249 @@
+import mmap
+import os
+import random
+import struct
+import time
+from array import array
+from bisect import bisect_left
+
+from models import db, Question, Category
+from .quiz import pick
+
+'''
+Quiz packs
+
+    A quiz pack is a read-only snapshot of the questions and categories
+    in one binary file, written by:
+
+    flask build-quiz-pack quiz.pack
+
+    With QUIZ_PACK_PATH set, POST /quizzes draws its questions from the
+    pack instead of the database. The file is memory-mapped, so all the
+    worker processes share the pages of the same file and a worker does
+    not load the questions in its own memory. Changes of the questions
+    after the build are not seen until the pack is built again and the
+    server restarted.
+
+    The file, little-endian, starts with the header (magic, version,
+    questions n, categories c) followed by arrays of unsigned 32-bit
+    integers, in the order:
+    - ids[n], categories[n] and difficulties[n] of the questions,
+      ordered by (category, id), so every category is a range of them
+    - sorted_ids[n] of all questions, and positions[n], the index of
+      every sorted id in ids
+    - text_offsets[2n + 1]: the question i is text[offsets[2i]:
+      offsets[2i + 1]], its answer text[offsets[2i + 1]:offsets[2i + 2]]
+    - category_ids[c], sorted, category_starts[c] and category_ends[c],
+      the range of every category in ids, and type_offsets[c + 1] of
+      their types in the text after the answers
+    - the text, UTF-8
+'''
+
+MAGIC = b'TQPK'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+
+DEFAULT_PATH = 'quiz.pack'
+
+
+def _uint32_array(values):
+    values = array('I', values)
+    if struct.pack('=I', 1) != struct.pack('<I', 1):
+        values.byteswap()
+    return values
+
+
+'''
+write_quiz_pack(path, questions, categories)
+    writes the pack of the questions as (id, category_id, difficulty,
+    question, answer) and the categories as (id, type), replacing the
+    file at once. Returns the size of the file.
+'''
+
+
+def write_quiz_pack(path, questions, categories):
+    questions = sorted(
+        questions, key=lambda question: (question[1] or 0, question[0]))
+    categories = sorted(categories)
+    count = len(questions)
+
+    ids = [question[0] for question in questions]
+    order = sorted(range(count), key=ids.__getitem__)
+
+    text = bytearray()
+    text_offsets = [0]
+    for question in questions:
+        for value in question[3:5]:
+            text += (value or '').encode('utf-8')
+            text_offsets.append(len(text))
+
+    category_of = [question[1] or 0 for question in questions]
+    category_starts = [
+        bisect_left(category_of, category_id)
+        for category_id, category_type in categories]
+    category_ends = [
+        bisect_left(category_of, category_id + 1)
+        for category_id, category_type in categories]
+
+    type_offsets = [len(text)]
+    for category_id, category_type in categories:
+        text += (category_type or '').encode('utf-8')
+        type_offsets.append(len(text))
+
+    arrays = [
+        ids,
+        category_of,
+        [question[2] or 0 for question in questions],
+        [ids[position] for position in order],
+        order,
+        text_offsets,
+        [category_id for category_id, category_type in categories],
+        category_starts,
+        category_ends,
+        type_offsets
+    ]
+
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as pack_file:
+        pack_file.write(HEADER.pack(MAGIC, VERSION, count, len(categories)))
+        for values in arrays:
+            _uint32_array(values).tofile(pack_file)
+        pack_file.write(text)
+    os.replace(temporary_path, path)
+
+    return os.path.getsize(path)
+
+
+'''
+build_quiz_pack(path)
+    writes the pack of the questions and categories of the database,
+    read in one transaction. Returns a summary with the number of
+    questions and categories, the size and the seconds.
+'''
+
+
+def build_quiz_pack(path):
+    started = time.perf_counter()
+
+    categories = db.session.query(Category.id, Category.type).all()
+    questions = db.session.query(
+        Question.id, Question.category_id, Question.difficulty,
+        Question.question, Question.answer).all()
+    db.session.commit()
+
+    size = write_quiz_pack(path, questions, categories)
+
+    return {
+        'questions': len(questions),
+        'categories': len(categories),
+        'bytes': size,
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+
+
+class QuizPack:
+
+    def __init__(self, path):
+        with open(path, 'rb') as pack_file:
+            self._mmap = mmap.mmap(
+                pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, categories = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not a quiz pack'.format(path))
+        if struct.pack('=I', 1) != struct.pack('<I', 1):
+            raise ValueError('quiz packs are little-endian')
+
+        self.path = path
+        self.count = count
+        view = memoryview(self._mmap)
+        offset = HEADER.size
+
+        # the arrays as views of the mapped file, nothing is copied
+        def uint32s(length):
+            nonlocal offset
+            values = view[offset:offset + 4 * length].cast('I')
+            offset += 4 * length
+            return values
+
+        self._ids = uint32s(count)
+        self._categories = uint32s(count)
+        self._difficulties = uint32s(count)
+        self._sorted_ids = uint32s(count)
+        self._positions = uint32s(count)
+        self._text_offsets = uint32s(2 * count + 1)
+        self._category_ids = uint32s(categories)
+        self._category_starts = uint32s(categories)
+        self._category_ends = uint32s(categories)
+        self._type_offsets = uint32s(categories + 1)
+        self._text = view[offset:]
+
+    def _category_index(self, category_id):
+        index = bisect_left(self._category_ids, category_id)
+        if index < len(self._category_ids) and \
+                self._category_ids[index] == category_id:
+            return index
+        return None
+
+    def has_category(self, category_id):
+        return self._category_index(category_id) is not None
+
+    # {id: type} of the categories
+    def categories(self):
+        return {
+            category_id: self._string(self._type_offsets, index)
+            for index, category_id in enumerate(self._category_ids)}
+
+    # the sorted ids of the category, of all questions for 0
+    def deck(self, category_id):
+        if category_id == 0:
+            return self._sorted_ids
+        index = self._category_index(category_id)
+        if index is None:
+            return self._sorted_ids[0:0]
+        return self._ids[
+            self._category_starts[index]:self._category_ends[index]]
+
+    '''
+    pick(category_id, previous_ids)
+        returns the id of a uniformly random question of the category
+        which is not in previous_ids, None if all of them were asked
+    '''
+
+    def pick(self, category_id, previous_ids, rng=random):
+        return pick(self.deck(category_id), previous_ids, rng)
+
+    # the question as formatted by Question.format(), None if unknown
+    def question(self, question_id):
+        position = bisect_left(self._sorted_ids, question_id)
+        if position == self.count or \
+                self._sorted_ids[position] != question_id:
+            return None
+
+        index = self._positions[position]
+        return {
+            'id': question_id,
+            'question': self._string(self._text_offsets, 2 * index),
+            'answer': self._string(self._text_offsets, 2 * index + 1),
+            'category': self._categories[index] or None,
+            'difficulty': self._difficulties[index]
+        }
+
+    def _string(self, offsets, index):
+        return bytes(
+            self._text[offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+    def __len__(self):
+        return self.count
+
+
+'''
+open_quiz_pack(path)
+    the QuizPack of the file, None without a path
+'''
+
+
+def open_quiz_pack(path=None):
+    if not path:
+        return None
+    return QuizPack(path)
@@ -0,0 +1,142 @@
+import json
+import secrets
+import threading
+import time
+from collections import deque
+
+'''
+Quiz sessions
+
+    A quiz session holds a shuffled deck of question ids for the
+    chosen category, so /quizzes only has to pop the next id instead of
+    receiving and filtering the growing list of previous questions.
+
+    The sessions live in a store with a time to live (TTL), refreshed
+    on every use:
+    - MemorySessionStore keeps them in the process (default)
+    - RedisSessionStore keeps them in Redis, or in any client with the
+      same interface, so all workers share the sessions
+
+    store.create(question_ids, category) returns the session id
+    store.pop(session_id) returns (question_id, category),
+        question_id is None when the deck is empty.
+        Raises KeyError for an unknown or expired session.
+'''
+
+DEFAULT_TTL = 60 * 60
+
+
+def new_session_id():
+    return secrets.token_urlsafe(16)
+
+
+class MemorySessionStore:
+
+    def __init__(self, ttl=DEFAULT_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        # {session_id: [deck, category, expires_at]}
+        self._sessions = {}
+        self._next_sweep = 0
+        self._lock = threading.Lock()
+
+    def create(self, question_ids, category):
+        session_id = new_session_id()
+        now = self.clock()
+
+        with self._lock:
+            self._evict_expired(now)
+            self._sessions[session_id] = [
+                deque(question_ids), category, now + self.ttl]
+
+        return session_id
+
+    def pop(self, session_id):
+        now = self.clock()
+
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session[2] <= now:
+                self._sessions.pop(session_id, None)
+                raise KeyError(session_id)
+
+            deck, category, expires_at = session
+            session[2] = now + self.ttl
+            question_id = deck.popleft() if deck else None
+
+        return question_id, category
+
+    def __len__(self):
+        return len(self._sessions)
+
+    # drop the expired sessions, at most once per TTL
+    def _evict_expired(self, now):
+        if now < self._next_sweep:
+            return
+
+        expired = [
+            session_id for session_id, session in self._sessions.items()
+            if session[2] <= now]
+        for session_id in expired:
+            del self._sessions[session_id]
+
+        self._next_sweep = now + self.ttl
+
+
+class RedisSessionStore:
+
+    def __init__(self, client, ttl=DEFAULT_TTL, prefix='trivia:quiz:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _keys(self, session_id):
+        key = self.prefix + session_id
+        return key + ':deck', key + ':category'
+
+    def create(self, question_ids, category):
+        session_id = new_session_id()
+        deck_key, category_key = self._keys(session_id)
+
+        pipeline = self.client.pipeline()
+        if question_ids:
+            pipeline.rpush(deck_key, *question_ids)
+            pipeline.expire(deck_key, self.ttl)
+        pipeline.set(category_key, json.dumps(category), ex=self.ttl)
+        pipeline.execute()
+
+        return session_id
+
+    def pop(self, session_id):
+        deck_key, category_key = self._keys(session_id)
+
+        pipeline = self.client.pipeline()
+        pipeline.lpop(deck_key)
+        pipeline.get(category_key)
+        pipeline.expire(deck_key, self.ttl)
+        pipeline.expire(category_key, self.ttl)
+        question_id, category = pipeline.execute()[:2]
+
+        if category is None:
+            raise KeyError(session_id)
+
+        if question_id is not None:
+            question_id = int(question_id)
+
+        return question_id, json.loads(category)
+
+
+'''
+create_session_store(url, ttl)
+    returns a RedisSessionStore for a redis:// url, else a
+    MemorySessionStore. The redis package is only needed
+    when a url is given.
+'''
+
+
+def create_session_store(url=None, ttl=DEFAULT_TTL):
+    if not url:
+        return MemorySessionStore(ttl)
+
+    import redis
+    return RedisSessionStore(redis.Redis.from_url(url), ttl)
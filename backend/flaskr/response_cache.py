@@ -0,0 +1,390 @@
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from models import Question, Category
+from .events import on_change, on_rows_change
+from .conditional import data_version
+from .pagination import NULL_CATEGORY
+
+'''
+Response cache of the paginated question lists
+
+    The pages are cached by PageKey(endpoint, category_id, page,
+    search_term) in groups:
+    - 'questions' for GET /questions, ordered by (category_id, id)
+    - 'category:<id>' for GET /categories/<id>/questions
+    - 'search:<term>' for POST /searchquestions
+    The total number of questions of every group is cached apart from
+    its pages, in the group 'totals', so a page survives the insertion
+    of a question in front of or behind it.
+
+    The invalidation is targeted. A question changing in category 3
+    only evicts:
+    - the pages of category 3 and its total
+    - the pages of /questions from the one holding the question on,
+      and the global total
+    - the search results of the terms found in the question
+    Any change of the categories, or an unknown change, clears the cache.
+    So does a change made by another process, seen with the shared data
+    version of flaskr.conditional.
+
+    The entries are kept in a backend:
+    - MemoryBackend, in the process, evicting the least recently used
+      entries above a memory cap (default)
+    - RedisBackend, shared by all processes, leaving the eviction to the
+      maxmemory policy of Redis
+    In both, an entry expires ttl seconds after it was written, which
+    bounds how long a page written by a request racing with a change in
+    another process can be served.
+'''
+
+PageKey = namedtuple(
+    'PageKey', ['endpoint', 'category_id', 'page', 'search_term'])
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+# seconds an entry is kept
+DEFAULT_TTL = 60
+
+TOTALS = 'totals'
+
+
+def group_of(key):
+    if key.endpoint == 'category':
+        return 'category:{}'.format(key.category_id)
+    if key.endpoint == 'search':
+        return 'search:{}'.format(key.search_term)
+    return key.endpoint
+
+
+# the key of a question, a row or a QuestionRow, in the order of the
+# listing of /questions, see flaskr.pagination
+def listing_key(question):
+    if isinstance(question, dict):
+        category_id, question_id = question['category_id'], question['id']
+    else:
+        category_id, question_id = question.category_id, question.id
+    if category_id is None:
+        category_id = NULL_CATEGORY
+    return category_id, question_id
+
+
+'''
+MemoryBackend
+    entries by (group, page) in least recently used order.
+    The size of an entry is the length of its JSON. An expired entry is
+    removed when it is read, or evicted as the least recently used.
+'''
+
+
+class MemoryBackend:
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL,
+                 clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.bytes = 0
+        self.evictions = 0
+        # {(group, page): (entry, size, expires_at)}
+        self._entries = OrderedDict()
+        # {group: {page, page}}
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def get(self, group, page):
+        with self._lock:
+            item = self._entries.get((group, page))
+            if item is None:
+                return None
+            if item[2] <= self.clock():
+                self._remove((group, page))
+                return None
+            self._entries.move_to_end((group, page))
+            return item[0]
+
+    def set(self, group, page, entry):
+        size = len(json.dumps(entry))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._remove((group, page))
+            self._entries[(group, page)] = (
+                entry, size, self.clock() + self.ttl)
+            self._groups.setdefault(group, set()).add(page)
+            self.bytes += size
+
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    # {page: entry} of a group, the expired entries included
+    def pages(self, group):
+        with self._lock:
+            return {
+                page: self._entries[(group, page)][0]
+                for page in self._groups.get(group, ())}
+
+    def groups(self, prefix):
+        with self._lock:
+            return [
+                group for group in self._groups if group.startswith(prefix)]
+
+    # delete some pages of a group, all of them by default.
+    # returns the number of deleted entries
+    def delete(self, group, pages=None):
+        with self._lock:
+            if pages is None:
+                pages = list(self._groups.get(group, ()))
+            return sum(self._remove((group, page)) for page in pages)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        item = self._entries.pop(key, None)
+        if item is None:
+            return 0
+
+        self.bytes -= item[1]
+        group, page = key
+        pages = self._groups[group]
+        pages.discard(page)
+        if not pages:
+            del self._groups[group]
+        return 1
+
+
+'''
+RedisBackend
+    a hash per group, {page: [expires_at, entry] as JSON}, and the set of
+    the groups. The fields of a hash cannot expire one by one, so every
+    entry holds the time it expires at, checked when it is read. A hash
+    and the set expire ttl seconds after their last write, and the
+    groups whose hash expired are pruned from the set when it is read.
+'''
+
+
+class RedisBackend:
+
+    def __init__(self, client, ttl=DEFAULT_TTL, prefix='trivia:pages:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.evictions = 0
+
+    def _key(self, group):
+        return self.prefix + group
+
+    def get(self, group, page):
+        value = self.client.hget(self._key(group), page)
+        if value is None:
+            return None
+
+        expires_at, entry = json.loads(value)
+        if expires_at <= time.time():
+            self.client.hdel(self._key(group), page)
+            return None
+        return entry
+
+    def set(self, group, page, entry):
+        value = json.dumps([time.time() + self.ttl, entry])
+        pipeline = self.client.pipeline()
+        pipeline.hset(self._key(group), page, value)
+        pipeline.expire(self._key(group), self.ttl)
+        pipeline.sadd(self.prefix + 'groups', group)
+        pipeline.expire(self.prefix + 'groups', self.ttl)
+        pipeline.execute()
+
+    # {page: entry} of a group, the expired entries included
+    def pages(self, group):
+        return {
+            page.decode(): json.loads(value)[1]
+            for page, value in self.client.hgetall(self._key(group)).items()}
+
+    def groups(self, prefix):
+        groups = [
+            group.decode()
+            for group in self.client.smembers(self.prefix + 'groups')]
+
+        # drop the groups whose hash expired
+        pipeline = self.client.pipeline()
+        for group in groups:
+            pipeline.exists(self._key(group))
+        exists = pipeline.execute()
+        expired = [
+            group for group, found in zip(groups, exists) if not found]
+        if expired:
+            self.client.srem(self.prefix + 'groups', *expired)
+
+        return [
+            group for group, found in zip(groups, exists)
+            if found and group.startswith(prefix)]
+
+    def delete(self, group, pages=None):
+        if pages is None:
+            deleted = self.client.hlen(self._key(group))
+            self.client.delete(self._key(group))
+            self.client.srem(self.prefix + 'groups', group)
+            return deleted
+        if not pages:
+            return 0
+        return self.client.hdel(self._key(group), *pages)
+
+    def clear(self):
+        for group in self.groups(''):
+            self.delete(group)
+
+    def __len__(self):
+        return sum(
+            self.client.hlen(self._key(group)) for group in self.groups(''))
+
+
+class ResponseCache:
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # bumped on every invalidation
+        self._generation = 0
+
+    # read before querying a page and given to put(), changes with every
+    # invalidation and with the shared data version
+    @property
+    def generation(self):
+        return self._generation, data_version.value
+
+    '''
+    get(key, count)
+        returns the cached response of the page, None on a miss.
+        count() is only called when the total of the group was evicted.
+    '''
+
+    def get(self, key, count):
+        group = group_of(key)
+        entry = self.backend.get(group, str(key.page))
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        total_questions = self.backend.get(TOTALS, group)
+        if total_questions is None:
+            total_questions = count()
+            self.backend.set(TOTALS, group, total_questions)
+
+        data = dict(entry['data'])
+        data['total_questions'] = total_questions
+        return data
+
+    '''
+    put(key, data, questions, per_page, generation)
+        caches the response data of a page listing the questions.
+        generation is the one read before querying the questions,
+        the page is not kept if the cache was invalidated meanwhile.
+    '''
+
+    def put(self, key, data, questions, per_page, generation):
+        if generation != self.generation:
+            return
+
+        group = group_of(key)
+        data = dict(data)
+        total_questions = data.pop('total_questions')
+
+        last = questions[-1] if questions else None
+        entry = {
+            'data': data,
+            'last_key': list(listing_key(last)) if last else None,
+            'full': len(questions) >= per_page
+        }
+
+        self.backend.set(group, str(key.page), entry)
+        self.backend.set(TOTALS, group, total_questions)
+
+    def clear(self, *args):
+        self._generation += 1
+        self.invalidations += len(self.backend)
+        self.backend.clear()
+
+    def invalidate(self, rows):
+        if rows is None:
+            return self.clear()
+
+        self._generation += 1
+
+        if not rows or any(row.get('id') is None for row in rows):
+            return self.clear()
+        keys = [listing_key(row) for row in rows]
+
+        # the pages of the categories of the changed questions
+        stale_groups = {
+            'category:{}'.format(row['category_id']) for row in rows}
+
+        # the search results of the terms found in the changed questions
+        texts = [(row.get('question') or '').lower() for row in rows]
+        for group in self.backend.groups('search:'):
+            term = group[len('search:'):]
+            if any(term in text for text in texts):
+                stale_groups.add(group)
+
+        for group in stale_groups:
+            self.invalidations += self.backend.delete(group)
+
+        # the pages of /questions from the first changed question on,
+        # and the last page which may grow
+        first_key = min(keys)
+        stale_pages = [
+            page for page, entry in self.backend.pages('questions').items()
+            if not entry['full'] or tuple(entry['last_key']) >= first_key]
+        self.invalidations += self.backend.delete('questions', stale_pages)
+
+        stale_groups.add('questions')
+        self.backend.delete(TOTALS, list(stale_groups))
+
+    def stats(self):
+        requests = self.hits + self.misses
+        stats = {
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / requests if requests else 0.0,
+            'evictions': self.backend.evictions,
+            'invalidations': self.invalidations
+        }
+        if isinstance(self.backend, MemoryBackend):
+            stats['bytes'] = self.backend.bytes
+            stats['max_bytes'] = self.backend.max_bytes
+        return stats
+
+
+'''
+create_response_cache_backend(url, max_bytes, ttl)
+    returns a RedisBackend for a redis:// url, else a MemoryBackend.
+    The redis package is only needed when a url is given.
+'''
+
+
+def create_response_cache_backend(url=None, max_bytes=DEFAULT_MAX_BYTES,
+                                  ttl=DEFAULT_TTL):
+    if not url:
+        return MemoryBackend(max_bytes, ttl)
+
+    import redis
+    return RedisBackend(redis.Redis.from_url(url), ttl)
+
+
+response_cache = ResponseCache()
+on_rows_change(Question, response_cache.invalidate)
+on_change(Category, response_cache.clear)
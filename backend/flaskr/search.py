@@ -0,0 +1,150 @@
+from models import db, Question
+from .cache import LoadedCache
+from .events import on_change
+
+'''
+Search backends for /searchquestions
+
+    Both backends find the questions containing the search term
+    (case-insensitive) and rank them by trigram similarity with the term.
+    An empty search term returns all questions ordered by category.
+
+    search(term, page, per_page) returns (questions, total_questions)
+'''
+
+
+def trigrams(text):
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def similarity(term_trigrams, text_trigrams):
+    if not term_trigrams or not text_trigrams:
+        return 0.0
+    common = len(term_trigrams & text_trigrams)
+    return common / len(term_trigrams | text_trigrams)
+
+
+# the ILIKE pattern of the questions containing the term literally,
+# % and _ are not wildcards. Use with escape='\\'.
+def like_pattern(term):
+    return '%{}%'.format(
+        term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+
+
+# load the questions of the page keeping the order of the ids
+def questions_by_ids(ids):
+    if not ids:
+        return []
+    questions = Question.rows().filter(Question.id.in_(ids)).all()
+    questions_by_id = {question.id: question for question in questions}
+    return [questions_by_id[i] for i in ids if i in questions_by_id]
+
+
+'''
+TrigramSearch
+    PostgreSQL backend. The ILIKE filter is served by the GIN trigram
+    index on questions.question created by flask init-db, instead of a
+    sequential scan of the table, and the results are ranked by
+    pg_trgm similarity().
+'''
+
+
+class TrigramSearch:
+
+    def search(self, term, page, per_page):
+        query = Question.rows()
+
+        if term:
+            query = query.filter(Question.question.ilike(
+                like_pattern(term), escape='\\')).order_by(
+                    db.func.similarity(Question.question, term).desc(),
+                    Question.id)
+        else:
+            query = query.order_by(Question.category_id, Question.id)
+
+        total_questions = query.order_by(None).count()
+        questions = query.limit(per_page).offset(
+            (page - 1) * per_page).all()
+
+        return questions, total_questions
+
+
+'''
+InvertedIndexSearch
+    In-process backend for the databases without trigram indexes,
+    like the SQLite test databases. It keeps an inverted index from
+    every trigram of the question text to the ids of the questions.
+    The index is built on the first search and rebuilt after a
+    question changes.
+'''
+
+
+class InvertedIndexSearch(LoadedCache):
+
+    def load(self):
+        # {id: (lower case question, trigrams, category_id)}
+        documents = {}
+        # {trigram: {id, id}}
+        postings = {}
+        rows = db.session.query(
+            Question.id, Question.question, Question.category_id)
+        for question_id, question, category_id in rows:
+            question = question or ''
+            question_trigrams = trigrams(question)
+            documents[question_id] = (
+                question.lower(), question_trigrams, category_id)
+            for trigram in question_trigrams:
+                postings.setdefault(trigram, set()).add(question_id)
+
+        return documents, postings
+
+    # ids of the matching questions in the order of the results
+    def matches(self, term):
+        documents, postings = self.get()
+
+        if not term:
+            return sorted(documents, key=lambda i: (documents[i][2], i))
+
+        term = term.lower()
+        term_trigrams = trigrams(term)
+
+        if term_trigrams:
+            # only the questions having every trigram of the term
+            # can contain the term, start with the rarest trigram
+            posting_sets = sorted(
+                (postings.get(trigram, set()) for trigram in term_trigrams),
+                key=len)
+            candidates = set.intersection(*posting_sets)
+        else:
+            # terms shorter than 3 characters have no trigram
+            candidates = documents
+
+        ranked = []
+        for question_id in candidates:
+            question, question_trigrams, category_id = documents[question_id]
+            if term in question:
+                score = similarity(term_trigrams, question_trigrams)
+                ranked.append((-score, question_id))
+        ranked.sort()
+
+        return [question_id for score, question_id in ranked]
+
+    def search(self, term, page, per_page):
+        ids = self.matches(term)
+        start = (page - 1) * per_page
+        questions = questions_by_ids(ids[start:start + per_page])
+
+        return questions, len(ids)
+
+
+trigram_search = TrigramSearch()
+inverted_index_search = InvertedIndexSearch()
+on_change(Question, inverted_index_search.invalidate)
+
+
+# the search backend for the database of the current app
+def search_backend():
+    if db.engine.dialect.name == 'postgresql':
+        return trigram_search
+    return inverted_index_search
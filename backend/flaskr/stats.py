@@ -0,0 +1,195 @@
+from collections import Counter
+
+from sqlalchemy import event
+
+from models import db, Question, Category
+from .cache import LoadedCache
+from .events import on_change, on_rows_change, row_values
+
+'''
+Aggregates of the question bank
+
+    The number of questions per category and difficulty is read by one
+    GROUP BY query and then kept up to date question by question: every
+    committed transaction adds the questions it inserted, removes the
+    ones it deleted and moves the updated ones from their previous to
+    their new category and difficulty. Only a bulk statement, a change
+    of the categories or a change by another process (see
+    flaskr.conditional) reloads them. So no COUNT(*) query is needed for
+    the totals of the paginated lists or for GET /stats, and only a few
+    numbers are kept whatever the size of the bank.
+'''
+
+
+class QuestionCounts(LoadedCache):
+
+    def __init__(self):
+        super().__init__()
+        # transactions which flushed questions and did not end yet
+        self._pending = 0
+
+    # {(category_id, difficulty): number of questions}
+    def load(self):
+        query = db.session.query(
+            Question.category_id, Question.difficulty,
+            db.func.count(Question.id)).group_by(
+            Question.category_id, Question.difficulty)
+        return {
+            (category_id, difficulty): size
+            for category_id, difficulty, size in query}
+
+    # loaded counts are not kept either while a transaction which
+    # flushed questions is open, they may include its questions, whose
+    # changes are added when it commits
+    def _keeps(self, version):
+        return super()._keeps(version) and not self._pending
+
+    # the changed rows of flaskr.events, the counts are only reloaded
+    # when the rows are not known
+    def rows_changed(self, rows):
+        if rows is None:
+            self.invalidate()
+
+    def begin(self):
+        with self._lock:
+            self._pending += 1
+
+    # the end of a transaction which flushed questions, with the changes
+    # of the counts it committed, None if they are not known
+    def end(self, changes):
+        with self._lock:
+            self._pending -= 1
+            if not changes and changes is not None:
+                return
+            self.version += 1
+            if changes is None or self._value is None:
+                self._value = None
+                return
+
+            # a new dictionary, the current one may be read meanwhile
+            counts = Counter(self._value)
+            counts.update(changes)
+            self._value = {
+                key: size for key, size in counts.items() if size > 0}
+
+
+counts = QuestionCounts()
+on_rows_change(Question, counts.rows_changed)
+# the questions of a deleted category are deleted by the database
+on_change(Category, counts.invalidate)
+
+
+# the (category_id, difficulty) of row values, None if not loaded
+def _count_key(values):
+    if 'category_id' not in values or 'difficulty' not in values:
+        return None
+    return values['category_id'], values['difficulty']
+
+
+# {(category_id, difficulty): change} of the flushed questions,
+# None if a changed question was not loaded
+def _flushed_changes(session):
+    changes = Counter()
+    instances = [(1, instance) for instance in session.new] + \
+        [(0, instance) for instance in session.dirty] + \
+        [(-1, instance) for instance in session.deleted]
+
+    for change, instance in instances:
+        if not isinstance(instance, Question):
+            continue
+        # the new values, then the previous ones of an update
+        rows = row_values(instance)
+        if change == 0:
+            if len(rows) == 1:
+                continue
+            keys = [(1, _count_key(rows[0])), (-1, _count_key(rows[1]))]
+        else:
+            keys = [(change, _count_key(rows[-1]))]
+
+        for change, key in keys:
+            if key is None:
+                return None
+            changes[key] += change
+
+    return changes
+
+
+@event.listens_for(db.session, 'after_flush')
+def _count_flush(session, flush_context):
+    changes = _flushed_changes(session)
+    if changes is not None and not any(changes.values()) and \
+            'question_counts' not in session.info:
+        return
+
+    if 'question_counts' not in session.info:
+        counts.begin()
+        session.info['question_counts'] = Counter()
+    pending = session.info['question_counts']
+    if pending is not None and changes is not None:
+        pending.update(changes)
+    else:
+        session.info['question_counts'] = None
+
+
+@event.listens_for(db.session, 'after_commit')
+def _count_commit(session):
+    if 'question_counts' in session.info:
+        counts.end(session.info.pop('question_counts'))
+
+
+# a rollback, or a session closed without committing, adds nothing
+@event.listens_for(db.session, 'after_transaction_end')
+def _count_transaction_end(session, transaction):
+    if transaction.parent is None and 'question_counts' in session.info:
+        session.info.pop('question_counts')
+        counts.end(Counter())
+
+
+# {(category_id, difficulty): number of questions}
+def question_counts():
+    return counts.get()
+
+
+# number of questions of the category, of all questions by default
+def total_questions(category_id=None):
+    return sum(
+        size for (question_category_id, difficulty), size
+        in question_counts().items()
+        if category_id is None or question_category_id == category_id)
+
+
+'''
+question_stats(categories)
+    the totals of the question bank, of every category of categories
+    {id: type} and of every difficulty
+'''
+
+
+def question_stats(categories):
+    stats = {
+        'total_questions': 0,
+        'total_categories': len(categories),
+        'categories': {
+            category_id: {
+                'type': category_type,
+                'total_questions': 0,
+                'difficulties': {}
+            }
+            for category_id, category_type in categories.items()},
+        'difficulties': {}
+    }
+
+    for (category_id, difficulty), size in question_counts().items():
+        if size == 0:
+            continue
+
+        stats['total_questions'] += size
+        stats['difficulties'][difficulty] = \
+            stats['difficulties'].get(difficulty, 0) + size
+
+        category = stats['categories'].get(category_id)
+        if category is not None:
+            category['total_questions'] += size
+            category['difficulties'][difficulty] = size
+
+    return stats
@@ -0,0 +1,140 @@
+import re
+from bisect import bisect_left, insort
+
+from models import db, Question
+from .events import on_rows_change
+from .cache import IncrementalIndex
+
+'''
+Search-as-you-type suggestions
+
+    PrefixIndex keeps a sorted array of (word, question id) for every
+    word of every question, lower case. The questions having a word
+    starting with a prefix are next to each other in the array, found
+    by a binary search, so a suggestion costs O(log n) plus the
+    suggestions returned, without a database query.
+
+    The array is loaded once. A changed question only has its words
+    removed and inserted again, re-read on the next suggestion. Every
+    removal or insertion shifts the end of the array, O(n) for n words
+    of all questions: a few milliseconds for a million words, cheap
+    next to the writes, which are rate limited, but not for bulk
+    changes, which drop and reload the whole array instead.
+'''
+
+WORD = re.compile(r'\w+')
+
+# entries of the array walked at most for one suggestion, bounding the
+# time of a prefix matching many words but few questions
+MAX_SCANNED = 10000
+
+
+def words(text):
+    return WORD.findall((text or '').lower())
+
+
+class PrefixIndex(IncrementalIndex):
+
+    # the index is (sorted [(word, question id)],
+    # {question id: (question, category_id, {word, word})})
+    def load(self):
+        entries = []
+        documents = {}
+        query = db.session.query(
+            Question.id, Question.question, Question.category_id)
+        for question_id, question, category_id in query:
+            question_words = set(words(question))
+            documents[question_id] = (question, category_id, question_words)
+            entries.extend((word, question_id) for word in question_words)
+        entries.sort()
+        return entries, documents
+
+    def read(self, ids):
+        return db.session.query(
+            Question.id, Question.question, Question.category_id).filter(
+            Question.id.in_(ids)).all()
+
+    # remove the words of the changed questions and insert the new ones
+    def apply(self, index, ids, rows):
+        entries, documents = index
+        for question_id in ids:
+            document = documents.pop(question_id, None)
+            if document is None:
+                continue
+            for word in document[2]:
+                position = bisect_left(entries, (word, question_id))
+                del entries[position]
+        for question_id, question, category_id in rows:
+            question_words = set(words(question))
+            documents[question_id] = (question, category_id, question_words)
+            for word in question_words:
+                insort(entries, (word, question_id))
+
+    '''
+    suggest(text, limit)
+        up to limit questions as (id, question, category_id) having a
+        word starting with every word of the text, in the alphabetical
+        order of their word completing the last word of the text
+    '''
+
+    def suggest(self, text, limit):
+        prefixes = words(text)
+        if not prefixes or limit < 1:
+            return []
+
+        entries, documents = self.get()
+
+        # the last word is being typed, the others are complete or not
+        prefix = prefixes[-1]
+        others = prefixes[:-1]
+
+        suggestions = []
+        seen = set()
+        with self._lock:
+            position = bisect_left(entries, (prefix,))
+            end = min(len(entries), position + MAX_SCANNED)
+            while position < end and len(suggestions) < limit:
+                word, question_id = entries[position]
+                position += 1
+                if not word.startswith(prefix):
+                    break
+                if question_id in seen:
+                    continue
+                seen.add(question_id)
+
+                question, category_id, question_words = (
+                    documents[question_id])
+                if all(any(word.startswith(other) for word in question_words)
+                       for other in others):
+                    suggestions.append((question_id, question, category_id))
+
+        return suggestions
+
+    def __len__(self):
+        index = self._value
+        return len(index[0]) if index is not None else 0
+
+
+'''
+suggest_categories(categories, text, limit)
+    up to limit (id, type) of the categories {id: type} having a word
+    starting with every word of the text
+'''
+
+
+def suggest_categories(categories, text, limit):
+    prefixes = words(text)
+    if not prefixes:
+        return []
+
+    suggestions = []
+    for category_id, category_type in sorted(categories.items()):
+        category_words = words(category_type)
+        if all(any(word.startswith(prefix) for word in category_words)
+               for prefix in prefixes):
+            suggestions.append((category_id, category_type))
+    return suggestions[:limit]
+
+
+prefix_index = PrefixIndex()
+on_rows_change(Question, prefix_index.invalidate)
@@ -1,6 +1,11 @@
-# import os
+import os
+import time
+from collections import namedtuple
 # from sqlalchemy import create_engine
-from flask_sqlalchemy import SQLAlchemy
+from flask import request, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+from sqlalchemy.orm import Bundle
 # import json
 
 database_name = "trivia"
@@ -13,20 +18,114 @@ database_path = "postgres://{}:{}@{}/{}".format(
     host_port,
     database_name)
 
-db = SQLAlchemy()
+# bind key of the read replica
+REPLICA = 'replica'
+
+# seconds after a write during which the reads stay on the primary
+DEFAULT_REPLICA_LAG = 5.0
+
+# time.monotonic() of the last write, the replica may lag behind it
+_last_write = [float('-inf')]
+
+
+def record_write():
+    _last_write[0] = time.monotonic()
+
+
+'''
+RoutingSession
+    sends the reads of the GET and HEAD requests to the read replica,
+    if one is configured. Flushes, the other requests and the reads
+    made shortly after a write go to the primary, so the in-process
+    caches are never refilled from a replica lagging behind.
+'''
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._reads_from_replica():
+            return self.app.extensions['sqlalchemy'].db.get_engine(
+                self.app, bind=REPLICA)
+        return super().get_bind(mapper, clause)
+
+    def _reads_from_replica(self):
+        if self._flushing or not has_request_context():
+            return False
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        if REPLICA not in (self.app.config.get('SQLALCHEMY_BINDS') or {}):
+            return False
+
+        lag = self.app.config.get('DATABASE_REPLICA_LAG', DEFAULT_REPLICA_LAG)
+        return time.monotonic() - _last_write[0] > lag
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+'''
+engine_options(database_path, environ)
+    options of the SQLAlchemy engine, read from the environment:
+    - DB_POOL_SIZE, DB_MAX_OVERFLOW: connections kept in the pool and
+      opened above it under load, per process
+    - DB_POOL_TIMEOUT: seconds to wait for a free connection
+    - DB_POOL_RECYCLE: seconds after which a connection is replaced
+    - DB_POOL_PRE_PING: 'true' to test the connections before use
+    - DB_STATEMENT_TIMEOUT: milliseconds after which PostgreSQL cancels
+      a statement
+    SQLite does not pool its connections, so none of them apply to it.
+'''
+
+POOL_OPTIONS = [
+    ('pool_size', 'DB_POOL_SIZE', int),
+    ('max_overflow', 'DB_MAX_OVERFLOW', int),
+    ('pool_timeout', 'DB_POOL_TIMEOUT', float),
+    ('pool_recycle', 'DB_POOL_RECYCLE', int),
+    ('pool_pre_ping', 'DB_POOL_PRE_PING', lambda value: value == 'true')
+]
+
+
+def engine_options(database_path, environ=os.environ):
+    options = {}
+    if database_path.startswith('sqlite'):
+        return options
+
+    for option, name, parse in POOL_OPTIONS:
+        if environ.get(name):
+            options[option] = parse(environ[name].lower())
+
+    statement_timeout = environ.get('DB_STATEMENT_TIMEOUT')
+    if statement_timeout and database_path.startswith('postgres'):
+        options['connect_args'] = {
+            'options': '-c statement_timeout={}'.format(
+                int(statement_timeout))}
+
+    return options
+
 
 '''
-setup_db(app)
-    binds a flask application and a SQLAlchemy service
+setup_db(app, database_path, replica_path)
+    binds a flask application and a SQLAlchemy service.
+    The engine options are taken from SQLALCHEMY_ENGINE_OPTIONS,
+    the reads of the GET requests go to replica_path if given.
+    The engine connects on first use. The schema is created by the
+    migrations of flaskr.migrations, run with flask init-db.
 '''
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, replica_path=None):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    if replica_path:
+        app.config["SQLALCHEMY_BINDS"] = {REPLICA: replica_path}
     db.app = app
     db.init_app(app)
-    db.create_all()
 
 
 '''
@@ -65,10 +164,51 @@ Question
 
 '''
 
+# the fields of Question.format()
+FORMAT_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+
+'''
+QuestionRow
+    read model of a question for the read-only lists: a tuple of its
+    columns, in the order of FORMAT_FIELDS, with the attributes and the
+    format() of a Question. Unlike a Question it has no instance state,
+    is not kept in the identity map of the session and takes no more
+    memory than a tuple.
+'''
+
+
+class QuestionRow(namedtuple(
+        'QuestionRow',
+        ['id', 'question', 'answer', 'category_id', 'difficulty'])):
+
+    __slots__ = ()
+
+    def format(self):
+        return dict(zip(FORMAT_FIELDS, self))
+
+
+# the columns of a query as one QuestionRow per row
+class QuestionRowBundle(Bundle):
+
+    single_entity = True
+
+    def create_row_processor(self, query, procs, labels):
+        def process(row):
+            return QuestionRow._make([proc(row) for proc in procs])
+        return process
+
 
 class Question(db.Model):
     __tablename__ = 'questions'
 
+    # the questions of a category are listed ordered by id. the cursor
+    # pagination of all questions seeks on the index over
+    # (coalesce(category_id, -1), id) of flaskr.migrations
+    __table_args__ = (
+        db.Index('ix_questions_category_id_id', 'category_id', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
 
     # same question can not be added twice.
@@ -97,13 +237,23 @@ class Question(db.Model):
         db.session.delete(self)
         db.session.commit()
 
+    # the questions as QuestionRow read models, read from the columns.
+    # read-only lists skip building an ORM object for every question.
+    @classmethod
+    def rows(cls):
+        return db.session.query(QuestionRowBundle(
+            'question_row', cls.id, cls.question, cls.answer,
+            cls.category_id, cls.difficulty))
+
     # as per the frontend, we need to return the category id in category
-    # and it should be degremented by one to show the right icon
+    # and it should be degremented by one to show the right icon.
+    # read category_id directly, self.category would lazy load
+    # the category with one more SELECT for every question.
     def format(self):
         return {
             'id': self.id,
             'question': self.question,
             'answer': self.answer,
-            'category': self.category.id,
+            'category': self.category_id,
             'difficulty': self.difficulty
         }